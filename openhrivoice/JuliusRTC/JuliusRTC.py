@@ -25,10 +25,14 @@ import time, struct, traceback, getopt, wave, tempfile
 import optparse
 from glob import glob
 from lxml import *
-from bs4 import BeautifulSoup
-from xml.dom.minidom import Document
 
 from parsesrgs import *
+from grammarcache import opencache
+from moduleloop import getloop
+from juliusevents import *
+from audiocapture import UtteranceCapture
+from adinsender import AdinnetSender
+from grammarwatcher import GrammarWatcher
 
 import OpenRTM_aist
 import RTC
@@ -117,43 +121,61 @@ def askopenfilenames(title=''):
 
 #  Julius Wrappper
 #
-class JuliusWrap(threading.Thread):
+class JuliusWrap:
     CB_DOCUMENT = 1
     CB_LOGWAVE = 2
+    CB_LOGDATA = 3
     
     #
     #  Constructor
     #
     def __init__(self, language='jp', rtc=''):
-        threading.Thread.__init__(self)
         self._config = config()
         self._running = False
+        self._closed = threading.Event()
+        self._closed.set()
         self._platform = platform.system()
         self._gotinput = False
         self._lang = language
         self._memsize = "large"
         #self._memsize = "medium"
 
-        self._logdir = tempfile.mkdtemp()
+        self._logdir = None
+        self._record = 'memory'
+        self._capture = None
         self._callbacks = []
         self._grammars = {}
         self._firstgrammar = True
         self._activegrammars = {}
-        self._prevdata = ''
+        self._gramcond = threading.Condition()
+        self._syncsent = 0
+        self._syncdone = 0
+        self._gramerrors = {}
+        self._gramlock = threading.RLock()
 
         self._jconf_file = ""
 
         self._mode = 'grammar'
         #self._jcode = 'euc_jp'
         self._jcode = 'utf-8'
+        self._parser = JuliusStreamParser(self._jcode)
         self._p = None
 
+        self._startup_timeout = 30.0
+        self._startup_times = {}
+        self._moduleready = threading.Event()
+        self._ready = threading.Event()
+        self._error = None
+
         self._modulesocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self._audiosocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self._audiohost = "localhost"
         self._audioport = 0
         self._modulehost = "localhost"
         self._moduleport = 0
+        self._sender = None
+        self._adinnet_queue = 100
+        self._adinnet_overflow = 'block'
 
         if rtc :
             self._mode = rtc._mode
@@ -164,34 +186,60 @@ class JuliusWrap(threading.Thread):
             if os.path.isfile(rtc._jconf_file[0]) :
                 self._jconf_file = rtc._jconf_file[0]
 
+            if prop.getProperty("julius.record") :
+                self._record = prop.getProperty("julius.record")
+
+            if prop.getProperty("julius.startup_timeout") :
+                self._startup_timeout = float(prop.getProperty("julius.startup_timeout"))
+
+            if prop.getProperty("julius.adinnet_queue") :
+                self._adinnet_queue = int(prop.getProperty("julius.adinnet_queue"))
+
+            if prop.getProperty("julius.adinnet_overflow") :
+                self._adinnet_overflow = prop.getProperty("julius.adinnet_overflow")
+
+            #
+            #  connect to running Julius in client mode
+            if self._mode == "client" and prop.getProperty("julius.module_port") :
+                self.setupJuliusServer(prop.getProperty("julius.host") or "localhost",
+                                       int(prop.getProperty("julius.module_port")),
+                                       int(prop.getProperty("julius.adinnet_port")))
+
+        #
+        #  Recording of utterances (memory, disk or off)
+        if self._record == 'disk' :
+            self._logdir = tempfile.mkdtemp()
+        elif self._record == 'memory' :
+            self._capture = UtteranceCapture()
+
 
         ###########################################################
+        self._starttime = time.time()
         if self._mode != "client" :
             if self.setupSubprocess():
                 #print ("command line: %s" % " ".join(self._cmdline))
                 #print (self._cmdline)
-                self._p = subprocess.Popen(self._cmdline)
+                self._p = subprocess.Popen(self._cmdline, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+                self._startup_times['spawn'] = time.time() - self._starttime
+                self._stdout_reader = threading.Thread(target=self.read_stdout)
+                self._stdout_reader.daemon = True
+                self._stdout_reader.start()
                 self._running = True
 
         #####################################################
         #
-        #   Connect to Julius (try ten times)
-        time.sleep(1)
-        print ("connecting to ports")
-        for retry in range(0, 10):
-            try:
-                self._modulesocket.connect((self._modulehost, self._moduleport))
-            except socket.error:
-                time.sleep(1)
-                continue
-            break
-        for retry in range(0, 10):
-            try:
-                self._audiosocket.connect(( self._audiohost, self._audioport))
-            except socket.error:
-                time.sleep(1)
-                continue
-            break
+        #   Connect to Julius
+        if self._running or self._mode == "client" :
+            print ("connecting to ports")
+            if self.waitports():
+                self._running = True
+                self.startsender()
+            else:
+                print ("[error] %s" % (self._error,))
+                self._running = False
+                if self._p :
+                    self._p.terminate()
+                return
 
         #
         # for grammar mode
@@ -207,7 +255,7 @@ class JuliusWrap(threading.Thread):
         self._modulehost = host
         self._moduleport = mport
         self._audiohost  = host
-        self._audioport  = sport
+        self._audioport  = aport
     #
     # Parameter seting for Julius
     #
@@ -282,7 +330,8 @@ class JuliusWrap(threading.Thread):
         self._cmdline.extend(["-iwcd1", "max"])         # 第1パスの単語間トライフォン計算法を指定する．(同じコンテキストのトライフォン集合の全尤度の最大値を近似尤度として用いる)
         self._cmdline.extend(["-gprune", "safe"])       # safe pruning 上位N個が確実に求まる．正確．
         self._cmdline.extend(["-forcedict"])            # エラー単語を無視して続行する
-        self._cmdline.extend(["-record", self._logdir]) # 認識した音声データを連続したファイルに自動保存
+        if self._logdir :
+            self._cmdline.extend(["-record", self._logdir]) # 認識した音声データを連続したファイルに自動保存
         self._cmdline.extend(["-smpFreq", "16000"])     # サンプリング周波数(Hz)
 
         self._audioport = self.getunusedport()
@@ -296,6 +345,71 @@ class JuliusWrap(threading.Thread):
 
         return True
 
+    #
+    #  Read stdout of Julius and watch module mode ready message
+    #
+    def read_stdout(self):
+        for l in iter(self._p.stdout.readline, b''):
+            l = l.decode(self._jcode, 'replace')
+            if not self._moduleready.is_set() and l.find("Module mode ready") >= 0:
+                self._startup_times['model_load'] = time.time() - self._starttime
+                self._moduleready.set()
+            sys.stdout.write(l)
+        self._p.stdout.close()
+
+    #
+    #  Connect to the module port and the adinnet port of Julius
+    #  (poll with exponential backoff until startup timeout)
+    #
+    def waitports(self):
+        deadline = self._starttime + self._startup_timeout
+        t0 = time.time()
+        for (name, host, port) in (('module', self._modulehost, self._moduleport),
+                                   ('audio', self._audiohost, self._audioport)):
+            delay = 0.01
+            while True:
+                s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                try:
+                    s.connect((host, port))
+                    break
+                except socket.error:
+                    s.close()
+                if self._p and self._p.poll() is not None:
+                    self._error = "julius exited with code %d before opening %s port" % (self._p.returncode, name)
+                    return False
+                if time.time() + delay > deadline:
+                    self._error = "timeout (%.1f sec) to connect %s port %s:%d" % (self._startup_timeout, name, host, port)
+                    return False
+                if self._moduleready.is_set():
+                    time.sleep(0.01)
+                elif not self._moduleready.wait(delay):
+                    delay = min(delay * 2, 0.5)
+            if name == 'module':
+                self._modulesocket = s
+            else:
+                self._audiosocket = s
+        if 'model_load' not in self._startup_times:
+            self._startup_times['model_load'] = t0 - self._starttime
+        self._startup_times['port_open'] = time.time() - self._starttime - self._startup_times['model_load']
+        return True
+
+    #
+    #  Wait for the first status message from Julius
+    #
+    def wait_ready(self, timeout=None):
+        if timeout is None:
+            timeout = self._startup_timeout
+        if not self._ready.wait(timeout):
+            self._error = "no status message from julius within %.1f sec" % (timeout,)
+            return False
+        return True
+
+    #
+    #  Startup-phase timing (sec): spawn, model_load, port_open, first_status, total
+    #
+    def startup_times(self):
+        return dict(self._startup_times)
+
     #
     #  Connect to Julius
     def connect_to_julius(self, host, port):
@@ -313,6 +427,8 @@ class JuliusWrap(threading.Thread):
     #  close Julius
     def close_julius(self):
         if self._modulesocket :
+            getloop().unregister(self._modulesocket)
+            self._closed.set()
             try:
                 self._modulesocket.sendall("DIE\n".encode('utf-8'))
                 time.sleep(1)
@@ -335,9 +451,35 @@ class JuliusWrap(threading.Thread):
         except socket.error:
             return False
 
+    #
+    #  Start sender thread of adinnet
+    def startsender(self):
+        self._sender = AdinnetSender(self._audiosocket, self._adinnet_queue, self._adinnet_overflow,
+                                     reconnect=self.reconnect_adinnet,
+                                     onsent=(self._capture.write if self._capture else None))
+        self._sender.start()
+
+    #
+    #  Reconnect to Adinnet (Callback from AdinnetSender)
+    def reconnect_adinnet(self):
+        self.close_adinnet(False)
+        if self._running and self.connect_to_adinnet(self._audiohost, self._audioport):
+            return self._audiosocket
+        return None
+
+    #
+    #  Queue depth and send latency of adinnet sender
+    def adinnet_stats(self):
+        if self._sender :
+            return self._sender.stats()
+        return {}
+
     #
     #  close Adinnet
-    def close_adinnet(self):
+    def close_adinnet(self, stopsender=True):
+        if stopsender and self._sender :
+            self._sender.stop()
+            self._sender = None
         if self._audiosocket :
             try:
                 self._audiosocket.shutdown(socket.RDWR)
@@ -369,115 +511,283 @@ class JuliusWrap(threading.Thread):
             self._p.terminate()
         return 0
 
+    #
+    #  Reset state for reuse (Call on returning to JuliusPool)
+    #
+    def reset(self):
+        self._callbacks = []
+        self._grammars = {}
+        self._firstgrammar = True
+        self._activegrammars = {}
+        self._parser.reset()
+        if self._capture :
+            self._capture.reset()
+
     #
     #   Write to audio data
+    #     (written to the capture by the sender when sent to Julius)
     #
     def write(self, data):
-        try:
-            if len(data) > 0:
-                self._audiosocket.send(struct.pack("i", len(data)))
-                self._audiosocket.sendall(data)
-        except socket.error:
-            try:
-                self._audiosocket.connect((_audiohost, self._audioport))
-            except:
-                pass
+        if len(data) > 0 and self._sender :
+            self._sender.put(data)
         return 0
 
     #
-    #  Run
+    #  Start to receive messages from Julius
     #
-    def run(self):
-        while self._running:
+    def start(self):
+        self._closed.clear()
+        getloop().register(self._modulesocket, self.ondata, self.ondispatch, self.onclose)
+
+    #
+    #  Check receiving messages
+    #
+    def is_alive(self):
+        return not self._closed.is_set()
+
+    #
+    #  Check Julius process is usable (running and not exited)
+    #
+    def usable(self):
+        if not self._running or self._closed.is_set():
+            return False
+        return self._p is None or self._p.poll() is None
+
+    #
+    #  Wait until the module socket is closed
+    #
+    def join(self, timeout=None):
+        self._closed.wait(timeout)
+
+    #
+    #  Dispatch latency and callback time of the module socket
+    #
+    def stats(self):
+        return getloop().stats(self._modulesocket)
+
+    #
+    #  Module socket closed by Julius
+    #
+    def onclose(self):
+        print ('JuliusWrap: exit from event loop')
+        self._closed.set()
+
+    #
+    #  OnData (Callback from ModuleSocketLoop, called in the loop thread)
+    #    grammar status and capture are handled here, the callbacks to
+    #    be called in the dispatch thread are returned.
+    #
+    def ondata(self, data):
+        #print("==>",data)
+        self._gotinput = True
+        if not self._ready.is_set():
+            t = time.time() - self._starttime
+            self._startup_times['first_status'] = t - self._startup_times.get('model_load', 0) - self._startup_times.get('port_open', 0)
+            self._startup_times['total'] = t
+            self._ready.set()
+        items = []
+        for ev in self._parser.feed(data):
+            items.append((self.CB_DOCUMENT, ev))
+            if self._capture and isinstance(ev, InputEvent):
+                seg = self.oninput(ev)
+                if seg :
+                    items.append((self.CB_LOGDATA, seg))
+            elif isinstance(ev, GrammarEvent):
+                self.ongrammar(ev)
+        return items
+
+    #
+    #  OnDispatch (Callback from ModuleSocketLoop, called in the dispatch thread)
+    #
+    def ondispatch(self, items):
+        for (cbtype, data) in items:
+            try:
+              for c in self._callbacks:
+                  c(cbtype, data)
+            except:
+              traceback.print_exc()
+
+        if self._logdir :
             for f in glob(os.path.join(self._logdir, "*.wav")):
                 for c in self._callbacks:
                     c(self.CB_LOGWAVE, f)
-            try:
-                self._modulesocket.settimeout(1)
-                #data = self._prevdata + unicode(self._modulesocket.recv(1024*10),  self._jcode)
-                data = self._prevdata + self._modulesocket.recv(1024*10).decode(self._jcode)
-            except socket.timeout:
-                continue
-            except socket.error:
-                print ('socket error')
-                break
-            #print("==>",data)
-            self._gotinput = True
-            ds = data.split(".\n")
-            self._prevdata = ds[-1]
-            ds = ds[0:-1]
-            for d in ds:
-                try:
-                  dx = BeautifulSoup(d, "lxml")
-                  for c in self._callbacks:
-                      c(self.CB_DOCUMENT, dx)
-                except:
-                  import traceback
-                  traceback.print_exc()
-                  pass
 
-        print ('JuliusWrap: exit from event loop')
+    #
+    #  Slice utterance from captured audio data
+    #
+    def oninput(self, ev):
+        if ev.status == 'STARTREC':
+            self._capture.startrec()
+        elif ev.status == 'ENDREC':
+            return self._capture.endrec()
+        return None
 
     #
     #   Add grammer to Julius Server
     #
     def addgrammar(self, data, name):
-        if self._firstgrammar == True:
-            val="CHANGEGRAM %s\n" % (name,)
-            self._modulesocket.sendall(val.encode('utf-8'))
-            self._firstgrammar = False
-        else:
-            val="ADDGRAM %s\n" % (name,)
-            self._modulesocket.sendall(val.encode('utf-8'))
-        self._modulesocket.sendall(data.encode(self._jcode, 'backslashreplace'))
-        self._grammars[name] = len(self._grammars)
-        self._activegrammars[name] = True
-        time.sleep(0.1)
+        return self.setgrammars([(name, data),])
 
     #
     #  Activate current grammer
     #
     def activategrammar(self, name):
-        try:
-            gid = self._grammars[name]
-        except KeyError:
+        if not name in self._grammars:
             print ("[error] unknown grammar: %s" % (name,))
-            return
-        val="ACTIVATEGRAM %s\n" % (name,)
-        self._modulesocket.sendall(val.encode('utf-8'))
-        self._activegrammars[name] = True
-        time.sleep(0.1)
-
-
+            return False
+        return self.setgrammars([], list(self._activegrammars.keys()) + [name,])
 
     #
     #  Deactivate current grammer
     #
     def deactivategrammar(self, name):
-        try:
-            gid = self._grammars[name]
-        except KeyError:
+        if not name in self._grammars:
             print ("[error] unknown grammar: %s" % (name,))
-            return
-        val="DEACTIVATEGRAM %s" % (name,)
-        self._modulesocket.sendall(val.encode('utf-8'))
-        del self._activegrammars[name]
-        time.sleep(0.1)
+            return False
+        return self.setgrammars([], [g for g in self._activegrammars.keys() if g != name])
 
     #
     #  Synchronize grammer
     #
-    def syncgrammar(self):
-        self._modulesocket.sendall("SYNCGRAM\n".encode('utf-8'))
+    def syncgrammar(self, timeout=5.0):
+        with self._gramlock:
+            return self.sendsync([], timeout)
 
     #
     #  Switch grammer
     #
     def switchgrammar(self, name):
-        self.activategrammar(name)
-        for g in self._activegrammars.keys():
-            if g != name:
-                self.deactivategrammar(g)
+        if not name in self._grammars:
+            print ("[error] unknown grammar: %s" % (name,))
+            return
+        self.setgrammars([], [name,])
+
+    #
+    #  Send grammars and activate/deactivate grammars in one pipelined write
+    #    Julius answers each CHANGEGRAM/ADDGRAM with <GRAMMAR STATUS="RECEIVED"/>
+    #    and SYNCGRAM with <GRAMMAR STATUS="READY"/> after the grammars are
+    #    updated (GRAMINFO is sent only for the GRAMINFO command).
+    #    the grammar tables are updated only when Julius acknowledged.
+    #    grammars: list of (name, data) to be added
+    #    active  : names of grammars to be active (None: all added grammars stay active)
+    #
+    def setgrammars(self, grammars, active=None, timeout=5.0):
+        with self._gramlock:
+            return self.setgrammars_locked(grammars, active, timeout)
+
+    def setgrammars_locked(self, grammars, active, timeout):
+        tables = (dict(self._grammars), dict(self._activegrammars))
+        first = self._firstgrammar
+        cmds = []
+        for (name, data) in grammars:
+            if first == True:
+                cmds.append(("CHANGEGRAM %s\n" % (name,)).encode('utf-8'))
+                first = False
+            else:
+                cmds.append(("ADDGRAM %s\n" % (name,)).encode('utf-8'))
+            cmds.append(data.encode(self._jcode, 'backslashreplace'))
+            tables[0][name] = len(tables[0])
+            tables[1][name] = True
+        if active is not None:
+            cmds.extend(self.grammardiff(active, tables))
+        if len(cmds) == 0:
+            return True
+        if not self.sendsync(cmds, timeout):
+            return False
+        (self._grammars, self._activegrammars) = tables
+        self._firstgrammar = first
+        return True
+
+    #
+    #  Replace grammars on the running Julius in one pipelined write
+    #    grammars: list of (name, data) to be added or replaced
+    #    removed : names of grammars to be deleted
+    #    active  : names of grammars to be active (None: currently active ones)
+    #
+    def updategrammars(self, grammars, removed=(), active=None, timeout=5.0):
+        with self._gramlock:
+            return self.updategrammars_locked(grammars, removed, active, timeout)
+
+    def updategrammars_locked(self, grammars, removed, active, timeout):
+        if self._firstgrammar == True:
+            return self.setgrammars_locked(grammars, active, timeout)
+        if active is None:
+            active = [g for g in self._activegrammars.keys() if not g in removed]
+        tables = (dict(self._grammars), dict(self._activegrammars))
+        cmds = []
+        for name in list(removed) + [name for (name, data) in grammars]:
+            if name in tables[0]:
+                cmds.append(("DELGRAM %s\n" % (name,)).encode('utf-8'))
+                del tables[0][name]
+                tables[1].pop(name, None)
+        for (name, data) in grammars:
+            cmds.append(("ADDGRAM %s\n" % (name,)).encode('utf-8'))
+            cmds.append(data.encode(self._jcode, 'backslashreplace'))
+            tables[0][name] = len(tables[0])
+            tables[1][name] = True
+        cmds.extend(self.grammardiff(active, tables))
+        if len(cmds) == 0:
+            return True
+        if not self.sendsync(cmds, timeout):
+            return False
+        (self._grammars, self._activegrammars) = tables
+        return True
+
+    #
+    #  Commands to change the set of active grammars to 'active'
+    #    tables: (grammars, active grammars) updated by the commands
+    #
+    def grammardiff(self, active, tables):
+        (grammars, activegrammars) = tables
+        cmds = []
+        active = [g for g in active if g in grammars]
+        for g in active:
+            if not g in activegrammars:
+                cmds.append(("ACTIVATEGRAM %s\n" % (g,)).encode('utf-8'))
+                activegrammars[g] = True
+        for g in list(activegrammars.keys()):
+            if not g in active:
+                cmds.append(("DEACTIVATEGRAM %s\n" % (g,)).encode('utf-8'))
+                del activegrammars[g]
+        return cmds
+
+    #
+    #  Send commands followed by SYNCGRAM and wait for its READY
+    #    SYNCGRAMs are numbered and READYs are counted, so a late READY of
+    #    an earlier request does not acknowledge this one. ERRORs are
+    #    taken for the next SYNCGRAM to be answered.
+    #
+    def sendsync(self, cmds, timeout=5.0):
+        with self._gramcond:
+            self._syncsent += 1
+            token = self._syncsent
+            for t in [t for t in self._gramerrors.keys() if t < token]:
+                del self._gramerrors[t]
+        self._modulesocket.sendall(b''.join(cmds + ["SYNCGRAM\n".encode('utf-8')]))
+        with self._gramcond:
+            end = time.time() + timeout
+            while self._syncdone < token:
+                rest = end - time.time()
+                if rest <= 0:
+                    print ("[warning] no grammar READY from julius within %.1f sec" % (timeout,))
+                    return False
+                self._gramcond.wait(rest)
+            error = self._gramerrors.pop(token, None)
+        if error is not None:
+            print ("[error] grammar error: %s" % (error,))
+            return False
+        return True
+
+    #
+    #  READY and ERROR of grammar commands (Callback from ondata)
+    #
+    def ongrammar(self, ev):
+        with self._gramcond:
+            if ev.status == 'READY':
+                self._syncdone += 1
+                self._gramcond.notify_all()
+            elif ev.status == 'ERROR':
+                self._gramerrors.setdefault(self._syncdone + 1, ev.reason)
 
     #
     #  Set callback function
@@ -485,6 +795,148 @@ class JuliusWrap(threading.Thread):
     def setcallback(self, func):
         self._callbacks.append(func)
 
+#
+#  Pool of pre-started Julius processes
+#
+class JuliusPool:
+    #
+    #  Constructor
+    #
+    def __init__(self, size=1, idle_timeout=600):
+        self._size = size
+        self._idle_timeout = idle_timeout
+        self._idle = {}
+        self._pending = {}
+        self._cond = threading.Condition()
+        self._running = True
+
+        self._reaper = threading.Thread(target=self.reaper)
+        self._reaper.daemon = True
+        self._reaper.start()
+
+    #
+    #  Key of Julius process (language, acoustic model, jconf)
+    #
+    def key(self, language, rtc):
+        base_dir = rtc._manager._config.getProperty("julius.base_dir")
+        return (rtc._mode, language, base_dir, rtc._jconf_file[0])
+
+    #
+    #  Start new Julius process
+    #
+    def create(self, language, rtc):
+        j = JuliusWrap(language, rtc)
+        if j._running :
+            j.start()
+        return j
+
+    #
+    #  Start Julius process in background
+    #
+    def prewarm(self, language, rtc):
+        if self._size <= 0 :
+            return
+        key = self.key(language, rtc)
+        with self._cond:
+            if len(self._idle.get(key, [])) + self._pending.get(key, 0) >= self._size:
+                return
+            self._pending[key] = self._pending.get(key, 0) + 1
+        th = threading.Thread(target=self.prewarm_proc, args=(key, language, rtc))
+        th.daemon = True
+        th.start()
+
+    def prewarm_proc(self, key, language, rtc):
+        j = None
+        try:
+            j = self.create(language, rtc)
+        except:
+            traceback.print_exc()
+        with self._cond:
+            self._pending[key] -= 1
+            if j and j.usable() :
+                j._pool_key = key
+                self._idle.setdefault(key, []).append((j, time.time()))
+            self._cond.notify_all()
+
+    #
+    #  Lease Julius process
+    #
+    def lease(self, language, rtc):
+        key = self.key(language, rtc)
+        found = None
+        expired = []
+        with self._cond:
+            while True:
+                if self._idle.get(key) :
+                    j, t = self._idle[key].pop()
+                    if j.usable() :
+                        found = j
+                        break
+                    expired.append(j)
+                    continue
+                if self._pending.get(key, 0) == 0:
+                    break
+                self._cond.wait()
+        for j in expired:
+            print ("JuliusPool: evict exited julius")
+            self.destroy(j)
+        if found :
+            return found
+        j = self.create(language, rtc)
+        j._pool_key = key
+        return j
+
+    #
+    #  Return Julius process to the pool
+    #
+    def release(self, j):
+        j.reset()
+        key = getattr(j, '_pool_key', None)
+        with self._cond:
+            if self._running and j.usable() and key and len(self._idle.get(key, [])) < self._size:
+                self._idle.setdefault(key, []).append((j, time.time()))
+                return
+        self.destroy(j)
+
+    #
+    #  Terminate Julius process
+    #
+    def destroy(self, j):
+        j.terminate()
+        if j.is_alive():
+            j.join()
+
+    #
+    #  Evict idle Julius processes
+    #
+    def evict(self, force=False):
+        expired = []
+        now = time.time()
+        with self._cond:
+            for key in self._idle:
+                rest = []
+                for j, t in self._idle[key]:
+                    if force or not j.usable() or (self._idle_timeout > 0 and now - t > self._idle_timeout):
+                        expired.append(j)
+                    else:
+                        rest.append((j, t))
+                self._idle[key] = rest
+        for j in expired:
+            print ("JuliusPool: evict idle julius")
+            self.destroy(j)
+
+    def reaper(self):
+        while self._running:
+            time.sleep(1)
+            self.evict()
+
+    #
+    #  Shutdown pool
+    #
+    def shutdown(self):
+        self._running = False
+        self.evict(True)
+
 #
 #  JuliusRTC 
 #
@@ -546,6 +998,9 @@ class JuliusRTC(OpenRTM_aist.DataFlowComponentBase):
         self._lang = 'en'
         self._srgs = None
         self._j = None
+        self._pool = None
+        self._watcher = None
+        self._fingerprints = None
         self._mode = 'grammar'
         self._config = config()
 
@@ -596,6 +1051,15 @@ class JuliusRTC(OpenRTM_aist.DataFlowComponentBase):
         self._outport.appendProperty('description', 'Recognition result in XML format.')
         self.registerOutPort(self._outport._name, self._outport)
 
+        #
+        # create outport for result in JSON format (optional)
+        self._jsonport = None
+        if self._manager._config.getProperty("julius.result_json") == "on" :
+            self._jsondata = RTC.TimedString(RTC.Time(0,0), "")
+            self._jsonport = OpenRTM_aist.OutPort("result_json", self._jsondata)
+            self._jsonport.appendProperty('description', 'Recognition result (n-best hypotheses and confidence) in JSON format.')
+            self.registerOutPort(self._jsonport._name, self._jsonport)
+
         #
         # create outport for log
         self._logdata = RTC.TimedOctetSeq(RTC.Time(0,0), None)
@@ -622,6 +1086,7 @@ class JuliusRTC(OpenRTM_aist.DataFlowComponentBase):
     #
     def onFinalize(self):
         OpenRTM_aist.DataFlowComponentBase.onFinalize(self)
+        self.stopwatcher()
         if self._j:
             self._j.terminate()
             self._j.join()
@@ -639,38 +1104,139 @@ class JuliusRTC(OpenRTM_aist.DataFlowComponentBase):
         else:
             self._lang = self._srgs._lang
 
-        self._j = JuliusWrap(self._lang, self)
+        if self._pool :
+            self._j = self._pool.lease(self._lang, self)
+        else:
+            self._j = JuliusWrap(self._lang, self)
+            if self._j._running :
+                self._j.start()
         if not self._j._running :
+            self._logger.RTC_ERROR("failed to start julius: %s" % (self._j._error,))
+            self._j = None
             return RTC.RTC_ERROR
-
-        self._j.start()
         self._j.setcallback(self.onResult)
 
-        while self._j._gotinput == False:
-            time.sleep(0.1)
+        if not self._j.wait_ready():
+            self._logger.RTC_ERROR("failed to start julius: %s" % (self._j._error,))
+            self.kill_julius()
+            return RTC.RTC_ERROR
+        self._logger.RTC_INFO("julius startup time: %s" % (self.getStartupTimes(),))
 
         if self._j._mode == 'dictation' :
             self._logger.RTC_INFO("run with dictation mode")
         else:
-            for r in self._srgs._rules.keys():
-                gram = self._srgs.toJulius(r)
+            try:
+                grams = self._srgs.toJuliusAll(jobs=self.compilejobs())
+            except KeyError as e:
+                self._logger.RTC_ERROR("failed to compile grammar: %s" % (e,))
+                self.release_julius()
+                return RTC.RTC_ERROR
+            for (r, gram) in grams:
                 if gram == "":
+                    self._logger.RTC_ERROR("failed to compile grammar: %s" % (r,))
+                    self.release_julius()
                     return RTC.RTC_ERROR
-                self._logger.RTC_INFO("register grammar: %s" % (r,))
-                self._j.addgrammar(gram, r)
-            self._j.switchgrammar(self._srgs._rootrule)
+                self._logger.RTC_INFO("register grammar: %s (%.1f msec)" % (r, self._srgs._compiletimes.get(r, 0.0) * 1000))
+                if self._srgs._compilestats.get(r):
+                    st = self._srgs._compilestats[r]
+                    self._logger.RTC_INFO("  states: %d -> %d, arcs: %d -> %d" % (st['states'] + st['arcs']))
+            if self._srgs._cache :
+                self._logger.RTC_INFO("grammar cache: %s" % (self._srgs._cache.stats(),))
+            if not self._j.setgrammars(grams, [self._srgs._rootrule,]):
+                self._logger.RTC_WARN("grammar registration was not acknowledged by julius")
+            self.startwatcher()
+            if self._manager._config.getProperty("julius.grammar_keep_tree") == "off" :
+                self._srgs.droptree()
 
         return RTC.RTC_OK
 
+    #
+    #  Number of processes compiling grammar rules
+    #
+    def compilejobs(self):
+        jobs = 1
+        if self._manager._config.getProperty("julius.compile_jobs") :
+            jobs = int(self._manager._config.getProperty("julius.compile_jobs"))
+            if jobs <= 0:
+                jobs = os.cpu_count() or 1
+        return jobs
+
+    #
+    #  Start watching the grammar files (julius.grammar_watch: interval in sec)
+    #
+    def startwatcher(self):
+        interval = self._manager._config.getProperty("julius.grammar_watch")
+        if not interval or interval == "off" or float(interval) <= 0:
+            return
+        files = self._srgs.dependencies()
+        if len(files) == 0:
+            return
+        self._fingerprints = self._srgs.fingerprints()
+        self.stopwatcher()
+        self._watcher = GrammarWatcher(files, self.reloadgrammar, float(interval))
+        self._watcher.start()
+        self._logger.RTC_INFO("watching grammar files: %s" % (", ".join(files),))
+
+    #
+    #  Stop watching (waits for the reload in progress)
+    #
+    def stopwatcher(self):
+        if self._watcher :
+            self._watcher.terminate()
+            if self._watcher is not threading.current_thread():
+                self._watcher.join()
+            self._watcher = None
+
+    #
+    #  Reload the grammar and replace the changed rules on the running Julius
+    #    only the rules whose dependency closure changed are recompiled.
+    #    returns files of the new grammar, or None on failure.
+    #
+    def reloadgrammar(self):
+        if self._j is None or self._srgs is None or self._j._mode == 'dictation':
+            return None
+        start = time.time()
+        srgs = SRGS(self._srgs._filename, self._manager._config, False, self._srgs._cache, self._srgs._backend)
+        fingerprints = srgs.fingerprints()
+        old = self._fingerprints or {}
+        changed = [r for r in fingerprints.keys() if old.get(r) != fingerprints[r]]
+        removed = [r for r in old.keys() if not r in fingerprints]
+        try:
+            grams = srgs.toJuliusAll(changed, jobs=self.compilejobs())
+        except KeyError as e:
+            self._logger.RTC_ERROR("failed to compile grammar: %s" % (e,))
+            return None
+        compiled = time.time()
+
+        active = None
+        if srgs._rootrule != self._srgs._rootrule:
+            active = [srgs._rootrule,]
+        if not self._j.updategrammars(grams, removed, active):
+            self._logger.RTC_WARN("grammar update was not acknowledged by julius")
+        self._srgs = srgs
+        self._fingerprints = fingerprints
+        self._logger.RTC_INFO("reload grammar: %d changed (%s), %d removed, compile %.1f msec, %.1f msec to active" %
+                              (len(changed), ", ".join(changed), len(removed),
+                               (compiled - start) * 1000, (time.time() - start) * 1000))
+        if self._manager._config.getProperty("julius.grammar_keep_tree") == "off" :
+            srgs.droptree()
+        return srgs.dependencies()
+
+    #
+    #  Startup-phase timing of current Julius process
+    #
+    def getStartupTimes(self):
+        if self._j :
+            return self._j.startup_times()
+        return {}
+
     #
     #  OnDeactivate
     #
     def onDeactivate(self, ec_id):
         OpenRTM_aist.DataFlowComponentBase.onDeactivate(self, ec_id)
-        if self._j:
-            self._j.terminate()
-            self._j.join()
-            self._j = None
+        self.stopwatcher()
+        self.release_julius()
         return RTC.RTC_OK
 
     #
@@ -695,50 +1261,25 @@ class JuliusRTC(OpenRTM_aist.DataFlowComponentBase):
     #
     def onResult(self, type, data):
         if type == JuliusWrap.CB_DOCUMENT:
-            if data.input:
-                d=data.input
-                self._logger.RTC_INFO(d['status'])
-                self._statusdata.data = str(d['status'])
+            if isinstance(data, InputEvent):
+                self._logger.RTC_INFO(data.status)
+                self._statusdata.data = str(data.status)
                 self._statusport.write()
-            elif data.rejected:
-                d=data.rejected
+            elif isinstance(data, RejectedEvent):
                 self._logger.RTC_INFO('rejected')
                 self._statusdata.data = 'rejected'
                 self._statusport.write()
-            elif data.recogout:
-                d = data.recogout
-                doc = Document()
-                listentext = doc.createElement("listenText")
-                doc.appendChild(listentext)
-                for s in d.findAll('shypo'):
-                    hypo = doc.createElement("data")
-                    score = 0
-                    count = 0
-                    text = []
-                    for w in s.findAll('whypo'):
-                        if not w['word'] or  w['word'][0] == '<':
-                            continue
-                        whypo = doc.createElement("word")
-                        whypo.setAttribute("text", w['word'])
-                        whypo.setAttribute("score", w['cm'])
-                        hypo.appendChild(whypo)
-                        text.append(w['word'])
-                        score += float(w['cm'])
-                        count += 1
-                    if count == 0:
-                        score = 0
-                    else:
-                        score = score / count
-                    hypo.setAttribute("rank", s['rank'])
-                    hypo.setAttribute("score", str(score))
-                    hypo.setAttribute("likelihood", s['score'])
-                    hypo.setAttribute("text", " ".join(text))
-                    self._logger.RTC_INFO("#%s: %s (%s)" % (s['rank'], " ".join(text), str(score)))
-                    listentext.appendChild(hypo)
-                data = doc.toxml(encoding="utf-8")
+            elif isinstance(data, RecogoutEvent):
+                hypos = hypotheses(data)
+                for (rank, score, likelihood, words) in hypos:
+                    self._logger.RTC_INFO("#%s: %s (%s)" % (rank, " ".join([w for (w, cm) in words]), str(score)))
+                data = listentext(hypos).encode('utf-8')
                 #self._logger.RTC_INFO(data.decode('utf-8', 'backslashreplace'))
                 self._outdata.data = data.decode('unicode_escape')
                 self._outport.write()
+                if self._jsonport :
+                    self._jsondata.data = listenjson(hypos)
+                    self._jsonport.write()
 
         elif type == JuliusWrap.CB_LOGWAVE:
             t = os.stat(data).st_ctime
@@ -753,6 +1294,13 @@ class JuliusRTC(OpenRTM_aist.DataFlowComponentBase):
             except:
                 pass
 
+        elif type == JuliusWrap.CB_LOGDATA:
+            (t, wavdata) = data
+            tf = t - int(t)
+            self._logdata.tm = RTC.Time(int(t - tf), int(tf * 1000000000))
+            self._logdata.data = wavdata
+            self._logport.write()
+
     #
     #  Set Grammer
     #
@@ -765,7 +1313,11 @@ class JuliusRTC(OpenRTM_aist.DataFlowComponentBase):
     def setgrammarfile(self, gram, rebuid=False):
         self._grammer = gram
         print ("compiling grammar: %s" % (gram,))
-        self._srgs = SRGS(gram, self._properties, rebuid)
+        cache = None
+        if not rebuid:
+            cache = opencache(self._manager._config)
+        backend = self._manager._config.getProperty("julius.lexicon_backend") or None
+        self._srgs = SRGS(gram, self._manager._config, rebuid, cache, backend)
         print ("done")
 
     #
@@ -776,6 +1328,18 @@ class JuliusRTC(OpenRTM_aist.DataFlowComponentBase):
             self._j.join()
             self._j = None
 
+    #
+    #  Return Julius process to the pool (or terminate it)
+    #
+    def release_julius(self):
+        if self._j:
+            if self._pool :
+                self._pool.release(self._j)
+            else:
+                self._j.terminate()
+                self._j.join()
+            self._j = None
+
 #
 #  JuliusRTCManager Class
 #
@@ -798,6 +1362,14 @@ class JuliusRTCManager:
         parser.add_option('-r', '--rebuild-lexicon', dest='rebuild_lexicon', action="store_true",
                           default=False,
                           help='rebuild lexicon')
+
+        parser.add_option('--pool-size', dest='pool_size', action="store",
+                          type="int", default=0,
+                          help='number of idle julius processes started in advance and kept per model (default: 0, no pool)')
+
+        parser.add_option('--pool-idle-timeout', dest='pool_idle_timeout', action="store",
+                          type="float", default=600,
+                          help='seconds before an idle julius process is terminated (0: never)')
         try:
             opts, args = parser.parse_args()
         except optparse.OptionError as e:
@@ -826,6 +1398,10 @@ class JuliusRTCManager:
 
         self._rebuid_lexicon=opts.rebuild_lexicon
 
+        self._pool = None
+        if opts.pool_size > 0:
+            self._pool = JuliusPool(opts.pool_size, opts.pool_idle_timeout)
+
         self._grammars = args
         self._comp = {}
         self._manager = OpenRTM_aist.Manager.init(utils.genmanagerargs(opts))
@@ -844,6 +1420,8 @@ class JuliusRTCManager:
     def shutdown(self):
         for x in self._comp:
             self._comp[x].kill_julius()
+        if self._pool :
+            self._pool.shutdown()
         self._manager.shutdown()
 
     #
@@ -863,6 +1441,11 @@ class JuliusRTCManager:
                 self._comp[a]._lang='en'
             else:
                 self._comp[a].setgrammarfile(a, self._rebuid_lexicon)
+                self._comp[a]._lang = self._comp[a]._srgs._lang
+
+            if self._pool :
+                self._comp[a]._pool = self._pool
+                self._pool.prewarm(self._comp[a]._lang, self._comp[a])
 
 #
 #
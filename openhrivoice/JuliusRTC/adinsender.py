@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''Asynchronous sender of audio data to adinnet port of Julius
+
+Copyright (C) 2019
+    Isao Hara
+    National Institute of Advanced Industrial Science and Technology (AIST),
+    Japan
+    All rights reserved.
+
+Licensed under the Eclipse Public License -v 1.0 (EPL)
+http://www.opensource.org/licenses/eclipse-1.0.txt
+'''
+
+import socket, struct, threading, time
+import collections
+
+#
+#  Adinnet sender thread
+#    packets are put into a bounded queue and sent by the thread.
+#    small packets in the queue are coalesced into one adinnet frame.
+#    on a send error the connection is dropped (a partly sent frame breaks
+#    the length framing of adinnet) and frames are discarded until the
+#    reconnection succeeds. reconnection is retried with exponential backoff.
+#
+class AdinnetSender(threading.Thread):
+    BLOCK = 'block'
+    DROP_OLDEST = 'drop_oldest'
+    DROP_NEWEST = 'drop_newest'
+    BACKOFF_MIN = 0.1
+    BACKOFF_MAX = 5.0
+
+    #
+    #  Constructor
+    #    sock     : socket connected to adinnet port
+    #    maxqueue : max number of packets in the queue
+    #    policy   : overflow policy (block, drop_oldest, drop_newest)
+    #    maxframe : max bytes of a coalesced frame
+    #    reconnect: function returns new socket on send error (or None)
+    #    onsent   : function called with the data sent to Julius
+    #
+    def __init__(self, sock, maxqueue=100, policy='block', maxframe=32000, reconnect=None,
+                 onsent=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        if not policy in (self.BLOCK, self.DROP_OLDEST, self.DROP_NEWEST):
+            raise ValueError("unknown overflow policy: %s" % (policy,))
+        self._sock = sock
+        self._maxqueue = maxqueue
+        self._policy = policy
+        self._maxframe = maxframe
+        self._reconnect = reconnect
+        self._onsent = onsent
+        self._backoff = 0.0
+        self._retry_at = 0.0
+        self._queue = collections.deque()
+        self._cond = threading.Condition()
+        self._running = True
+
+        self._max_depth = 0
+        self._dropped = 0
+        self._send_dropped = 0
+        self._reconnects = 0
+        self._packets = 0
+        self._frames = 0
+        self._bytes = 0
+        self._total_latency = 0.0
+        self._max_latency = 0.0
+
+    #
+    #  put audio data (called from DataListener)
+    #
+    def put(self, data):
+        with self._cond:
+            if len(self._queue) >= self._maxqueue:
+                if self._policy == self.DROP_NEWEST:
+                    self._dropped += 1
+                    return False
+                elif self._policy == self.DROP_OLDEST:
+                    self._queue.popleft()
+                    self._dropped += 1
+                else:
+                    while self._running and len(self._queue) >= self._maxqueue:
+                        self._cond.wait()
+                    if not self._running:
+                        return False
+            self._queue.append(data)
+            if len(self._queue) > self._max_depth:
+                self._max_depth = len(self._queue)
+            self._cond.notify_all()
+        return True
+
+    #
+    #  take packets from the queue and join them up to maxframe bytes
+    #
+    def get(self):
+        with self._cond:
+            while self._running and len(self._queue) == 0:
+                self._cond.wait()
+            if not self._running:
+                return None
+            packets = [self._queue.popleft()]
+            size = len(packets[0])
+            while len(self._queue) > 0 and size + len(self._queue[0]) <= self._maxframe:
+                data = self._queue.popleft()
+                packets.append(data)
+                size += len(data)
+            self._cond.notify_all()
+        self._packets += len(packets)
+        return b''.join(packets)
+
+    #
+    #  get new connection (False while waiting for the backoff time)
+    #
+    def reconnect(self):
+        if self._reconnect is None or time.time() < self._retry_at:
+            return False
+        self._sock = self._reconnect()
+        if self._sock is None:
+            self._backoff = min(max(self._backoff * 2, self.BACKOFF_MIN), self.BACKOFF_MAX)
+            self._retry_at = time.time() + self._backoff
+            return False
+        self._reconnects += 1
+        self._backoff = 0.0
+        self._retry_at = 0.0
+        return True
+
+    #
+    #  Run
+    #
+    def run(self):
+        while self._running:
+            data = self.get()
+            if data is None:
+                break
+            if self._sock is None and not self.reconnect():
+                self._send_dropped += 1
+                continue
+            start = time.time()
+            try:
+                self._sock.sendall(struct.pack("i", len(data)) + data)
+            except socket.error:
+                self._send_dropped += 1
+                self._sock = None
+                self.reconnect()
+                continue
+            if self._onsent:
+                self._onsent(data)
+            latency = time.time() - start
+            self._frames += 1
+            self._bytes += len(data)
+            self._total_latency += latency
+            if latency > self._max_latency:
+                self._max_latency = latency
+
+    #
+    #  Stop sender thread
+    #
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._queue.clear()
+            self._cond.notify_all()
+
+    #
+    #  queue depth and send latency statistics
+    #
+    def stats(self):
+        return { 'depth': len(self._queue), 'max_depth': self._max_depth,
+                 'dropped': self._dropped, 'send_dropped': self._send_dropped,
+                 'reconnects': self._reconnects, 'packets': self._packets,
+                 'frames': self._frames, 'bytes': self._bytes,
+                 'avg_latency': (self._total_latency / self._frames if self._frames > 0 else 0.0),
+                 'max_latency': self._max_latency }
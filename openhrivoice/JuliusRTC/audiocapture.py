@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''In-memory capture of recognized utterances
+
+Copyright (C) 2019
+    Isao Hara
+    National Institute of Advanced Industrial Science and Technology (AIST),
+    Japan
+    All rights reserved.
+
+Licensed under the Eclipse Public License -v 1.0 (EPL)
+http://www.opensource.org/licenses/eclipse-1.0.txt
+'''
+
+import threading, time
+
+#
+#  Ring buffer of audio data addressed by absolute byte offset
+#
+class AudioRingBuffer:
+    #
+    #  Constructor
+    #
+    def __init__(self, capacity):
+        self._capacity = capacity
+        self._buffer = bytearray(capacity)
+        self._total = 0
+        self._lock = threading.Lock()
+
+    #
+    #  append audio data
+    #
+    def write(self, data):
+        with self._lock:
+            n = len(data)
+            if n > self._capacity:
+                self._total += n - self._capacity
+                data = data[n - self._capacity:]
+                n = self._capacity
+            pos = self._total % self._capacity
+            first = min(n, self._capacity - pos)
+            self._buffer[pos:pos + first] = data[:first]
+            if first < n:
+                self._buffer[0:n - first] = data[first:]
+            self._total += n
+
+    #
+    #  total number of bytes written
+    #
+    def offset(self):
+        return self._total
+
+    #
+    #  get data between absolute offsets [start, end)
+    #
+    def slice(self, start, end):
+        with self._lock:
+            start = max(start, self._total - self._capacity, 0)
+            end = min(end, self._total)
+            if end <= start:
+                return b''
+            s = start % self._capacity
+            e = end % self._capacity
+            if s < e:
+                return bytes(self._buffer[s:e])
+            return bytes(self._buffer[s:] + self._buffer[:e])
+
+#
+#  Slice utterances using STARTREC/ENDREC of Julius
+#
+class UtteranceCapture:
+    #
+    #  Constructor
+    #    rate, width: sampling rate and sample width of audio data
+    #    buffer_sec : length of ring buffer
+    #    headmargin : audio before STARTREC included in utterance (sec)
+    #
+    def __init__(self, rate=16000, width=2, buffer_sec=30, headmargin=0.3):
+        self._bytes_per_sec = rate * width
+        self._width = width
+        self._ring = AudioRingBuffer(int(buffer_sec * self._bytes_per_sec))
+        self._headmargin = int(headmargin * self._bytes_per_sec)
+        self._start = None
+
+    #
+    #  audio data sent to Julius
+    #
+    def write(self, data):
+        self._ring.write(data)
+
+    #
+    #  forget the utterance in progress (on reuse of Julius process)
+    #
+    def reset(self):
+        self._start = None
+
+    #
+    #  STARTREC
+    #
+    def startrec(self):
+        start = max(self._ring.offset() - self._headmargin, 0)
+        self._start = start - start % self._width
+
+    #
+    #  ENDREC: returns (time, audio data) of the utterance or None
+    #
+    def endrec(self):
+        if self._start is None:
+            return None
+        end = self._ring.offset()
+        end = end - end % self._width
+        data = self._ring.slice(self._start, end)
+        self._start = None
+        if not data:
+            return None
+        return (time.time(), data)
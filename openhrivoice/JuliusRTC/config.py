@@ -48,6 +48,8 @@ class config():
             os.makedirs(self._configdir)
 
         self._lexicondb = os.path.join(self._configdir, 'lexcon.db')
+        self._lexiconmap = os.path.join(self._configdir, 'lexicon.map')
+        self._grammarcachedir = os.path.join(self._configdir, 'grammar_cache')
 
         #
         # default settings
@@ -0,0 +1,395 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''Compile-time benchmark of the SRGS to Julius converter
+
+Copyright (C) 2019
+    Isao Hara
+    National Institute of Advanced Industrial Science and Technology (AIST),
+    Japan
+    All rights reserved.
+
+Licensed under the Eclipse Public License -v 1.0 (EPL)
+http://www.opensource.org/licenses/eclipse-1.0.txt
+'''
+
+import sys, os, time, shutil, tempfile
+import optparse
+
+from __init__ import __version__
+
+#
+#  synthetic grammar of 'size' slots
+#    each slot is a word followed by an optional one-of of 'alternatives'
+#    words, or by a repeated word (repeat="0-3") in every fifth slot.
+#
+def synthetic_grammar(size, alternatives=3, lexicon=None):
+    out = [u'<?xml version="1.0" encoding="UTF-8" ?>',
+           u'<grammar xmlns="http://www.w3.org/2001/06/grammar" xml:lang="en" version="1.0" mode="voice" root="main">']
+    if lexicon:
+        out.append(u'  <lexicon uri="%s"/>' % (lexicon,))
+    out.append(u'  <rule id="main">')
+    for i in range(size):
+        out.append(u'    <item>w%d</item>' % (i,))
+        if i % 5 == 4:
+            out.append(u'    <item repeat="0-3">w%d_r</item>' % (i,))
+            continue
+        out.append(u'    <item repeat="0-1"><one-of>')
+        for a in range(alternatives):
+            out.append(u'      <item>w%d_%d</item>' % (i, a))
+        out.append(u'    </one-of></item>')
+    out.append(u'  </rule>')
+    out.append(u'</grammar>')
+    return u'\n'.join(out) + u'\n'
+
+#
+#  address book like one-of list of 'size' entries
+#    entries are "[title] first last" made from small vocabularies
+#
+def oneof_entries(size):
+    import random
+    rand = random.Random(size)
+    titles = [u'mister', u'doctor', u'professor']
+    entries = set()
+    while len(entries) < size:
+        e = []
+        if rand.random() < 0.2:
+            e.append(rand.choice(titles))
+        e.append(u'f%d' % (rand.randrange(1000),))
+        e.append(u'l%d' % (rand.randrange(5000),))
+        entries.add(u' '.join(e))
+    return sorted(entries)
+
+def oneof_grammar(size):
+    out = [u'<?xml version="1.0" encoding="UTF-8" ?>',
+           u'<grammar xmlns="http://www.w3.org/2001/06/grammar" xml:lang="en" version="1.0" mode="voice" root="main">',
+           u'  <rule id="main">',
+           u'    <item>call</item>',
+           u'    <one-of>']
+    for e in oneof_entries(size):
+        out.append(u'      <item>%s</item>' % (e,))
+    out.append(u'    </one-of>')
+    out.append(u'  </rule>')
+    out.append(u'</grammar>')
+    return u'\n'.join(out) + u'\n'
+
+#
+#  digits repeated with repeat="spec"
+#
+def repeat_grammar(spec):
+    digits = [u'zero', u'one', u'two', u'three', u'four', u'five', u'six', u'seven', u'eight', u'nine']
+    out = [u'<?xml version="1.0" encoding="UTF-8" ?>',
+           u'<grammar xmlns="http://www.w3.org/2001/06/grammar" xml:lang="en" version="1.0" mode="voice" root="main">',
+           u'  <rule id="digit"><one-of>']
+    for d in digits:
+        out.append(u'    <item>%s</item>' % (d,))
+    out.append(u'  </one-of></rule>')
+    out.append(u'  <rule id="main">')
+    out.append(u'    <item>number</item>')
+    out.append(u'    <item repeat="%s"><ruleref uri="#digit"/></item>' % (spec,))
+    out.append(u'  </rule>')
+    out.append(u'</grammar>')
+    return u'\n'.join(out) + u'\n'
+
+#
+#  grammar of 'rules' rules of one-of lists of 'entries' phrases
+#    phrases are made of words of the lexicon database. frequent words
+#    appear in many rules as in hand-written grammars. Japanese phrases
+#    are concatenated words to be segmented by substringlookup.
+#
+def vocabulary_grammar(words, rules, entries=20, lang='en'):
+    import random
+    rand = random.Random(rules)
+    out = [u'<?xml version="1.0" encoding="UTF-8" ?>',
+           u'<grammar xmlns="http://www.w3.org/2001/06/grammar" xml:lang="%s" version="1.0" mode="voice" root="rule0">' % (lang,)]
+    for r in range(rules):
+        out.append(u'  <rule id="rule%d"><one-of>' % (r,))
+        for e in range(entries):
+            phrase = [words[int(len(words) * rand.random() ** 3)] for i in range(rand.randint(1, 3))]
+            if lang in ('ja', 'jp'):
+                out.append(u'    <item>%s</item>' % (u''.join(phrase[:2]),))
+            else:
+                out.append(u'    <item>%s</item>' % (u' '.join(phrase),))
+        out.append(u'  </one-of></rule>')
+    out.append(u'</grammar>')
+    return u'\n'.join(out) + u'\n'
+
+#
+#  PLS lexicon of the words in the synthetic grammar
+#
+def synthetic_lexicon(size, alternatives=3):
+    out = [u'<?xml version="1.0" encoding="UTF-8"?>',
+           u'<lexicon version="1.0" xmlns="http://www.w3.org/2005/01/pronunciation-lexicon" alphabet="x-sampa" xml:lang="en">']
+    for i in range(size):
+        words = [u'w%d' % (i,)]
+        if i % 5 == 4:
+            words.append(u'w%d_r' % (i,))
+        else:
+            words.extend([u'w%d_%d' % (i, a) for a in range(alternatives)])
+        for w in words:
+            out.append(u'  <lexeme><grapheme>%s</grapheme><phoneme>d a b l y u</phoneme></lexeme>' % (w,))
+    out.append(u'</lexicon>')
+    return u'\n'.join(out) + u'\n'
+
+#
+#  Benchmark
+#
+class GrammarBench:
+    #
+    #  Constructor
+    #
+    def __init__(self, opts):
+        self._opts = opts
+        self._tmpdir = tempfile.mkdtemp()
+
+    def __del__(self):
+        shutil.rmtree(self._tmpdir, ignore_errors=True)
+
+    #
+    #  write the synthetic grammar and lexicon
+    #
+    def mkgrammar(self, size):
+        gfile = os.path.join(self._tmpdir, "bench%d.grxml" % (size,))
+        lfile = os.path.join(self._tmpdir, "bench%d.pls" % (size,))
+        with open(gfile, 'w', encoding='utf-8') as f:
+            f.write(synthetic_grammar(size, self._opts.alternatives, os.path.basename(lfile)))
+        with open(lfile, 'w', encoding='utf-8') as f:
+            f.write(synthetic_lexicon(size, self._opts.alternatives))
+        return gfile
+
+    #
+    #  time of one compile phase (best of 'repeat' runs)
+    #
+    def measure(self, func):
+        best = None
+        result = None
+        for r in range(self._opts.repeat):
+            t = time.time()
+            result = func()
+            t = time.time() - t
+            if best is None or t < best:
+                best = t
+        return best, result
+
+    #
+    #  Run
+    #    build: automaton of the rule in reverse order as SRGS.compile()
+    #    makes it (rule fragments spliced at rulerefs), before minimization
+    #
+    def run(self):
+        from parsesrgs import SRGS, arcstats, determinize, minimize
+        opts = self._opts
+        print ("%8s %10s %10s %12s %10s %10s %12s %12s" % ("slots", "states", "arcs", "build(ms)",
+                                                         "min-states", "min-arcs", "minimize(ms)", "compile(ms)"))
+        prev = None
+        for size in opts.sizes:
+            gfile = self.mkgrammar(size)
+            srgs = SRGS(gfile)
+            def build():
+                srgs._fragments.clear()
+                return srgs.build('main').reverse()
+            def compile():
+                srgs._fragments.clear()
+                return srgs.compile('main')
+            t_build, revdfa = self.measure(build)
+            t_min, mindfa = self.measure(lambda: minimize(determinize(revdfa)))
+            before = arcstats(revdfa)
+            after = arcstats(mindfa)
+            t_compile = 0.0
+            if opts.full:
+                t_compile, result = self.measure(compile)
+            print ("%8d %10d %10d %12.1f %10d %10d %12.1f %12.1f" % (size, before[0], before[1], t_build * 1000,
+                                                                   after[0], after[1], t_min * 1000, t_compile * 1000))
+            if prev is not None and prev[1] > 0:
+                print ("%8s x%.1f size, x%.1f build time" % ("", float(size) / prev[0], t_build / prev[1]))
+            prev = (size, t_build)
+
+    #
+    #  lookup of the words of grammars of the given numbers of rules in
+    #  the lexicon database, without and with the lookup cache
+    #
+    def run_lexicon(self, lang):
+        from parsesrgs import SRGS
+        from lexicondb import openlexicon, lexiconfile, LOOKUP_CACHE_SIZE
+        backend = self._opts.backend
+        t = time.time()
+        lexdb = openlexicon(__version__, backend=backend)
+        print ("open %s: %.1f msec" % (lexiconfile(backend), (time.time() - t) * 1000))
+        japanese = lang in ('ja', 'jp')
+        words = sorted([w for w in lexdb.keys() if (ord(w[0]) > 0x7f) == japanese])
+        words = words[::max(1, len(words) // 2000)][:2000]
+        if len(words) == 0:
+            print ("[error] no words of %s in %s" % (lang, lexiconfile(backend)))
+            return
+        print ("%8s %8s %8s %12s %12s %10s %10s %8s" % ("rules", "words", "cache", "lexicon(ms)", "compile(ms)",
+                                                       "queries", "hitrate", "unknown"))
+        for size in self._opts.sizes:
+            gfile = os.path.join(self._tmpdir, "vocabulary%d.grxml" % (size,))
+            with open(gfile, 'w', encoding='utf-8') as f:
+                f.write(vocabulary_grammar(words, size, 20, lang))
+            srgs = SRGS(gfile)
+            for cachesize in (0, LOOKUP_CACHE_SIZE):
+                lexdb = openlexicon(__version__, backend=backend, cachesize=cachesize)
+                srgs._phasetimes = {}
+                srgs._lexstats = dict([(k, 0) for k in srgs._lexstats.keys()])
+                unknown = 0
+                t = time.time()
+                for r in srgs._rules.keys():
+                    try:
+                        srgs.compile(r, None, lexdb)
+                    except KeyError:
+                        unknown += 1
+                t = time.time() - t
+                st = lexdb.stats()
+                hits = st['lookup']['hits'] + st['substring']['hits']
+                total = hits + st['lookup']['misses'] + st['substring']['misses']
+                print ("%8d %8d %8d %12.1f %12.1f %10d %9.1f%% %8d" %
+                       (size, srgs._lexstats['db_hits'] + srgs._lexstats['misses'], cachesize,
+                        srgs._phasetimes.get('lexicon', 0.0) * 1000, t * 1000, st['queries'],
+                        (100.0 * hits / total if total > 0 else 0.0), unknown))
+
+    #
+    #  large one-of lists: prefix trie against a chain of states per item
+    #
+    def run_oneof(self):
+        import tracemalloc
+        import parsesrgs
+        from parsesrgs import SRGS, arcstats, determinize, minimize
+        opts = self._opts
+        threshold = parsesrgs.TRIE_THRESHOLD
+        print ("%8s %6s %10s %10s %12s %10s %10s %12s %10s" % ("entries", "path", "states", "arcs", "build(ms)",
+                                                             "min-states", "min-arcs", "minimize(ms)", "peak(KB)"))
+        for size in opts.sizes:
+            gfile = os.path.join(self._tmpdir, "oneof%d.grxml" % (size,))
+            with open(gfile, 'w', encoding='utf-8') as f:
+                f.write(oneof_grammar(size))
+            for (path, th) in (("chain", sys.maxsize), ("trie", threshold)):
+                parsesrgs.TRIE_THRESHOLD = th
+                srgs = SRGS(gfile)
+                def build():
+                    srgs._fragments.clear()
+                    return srgs.build('main')
+                t_build, dfa = self.measure(build)
+                revdfa = dfa.reverse()
+                t_min, mindfa = self.measure(lambda: minimize(determinize(revdfa)))
+                before = arcstats(revdfa)
+                after = arcstats(mindfa)
+                del dfa, revdfa, mindfa
+                tracemalloc.start()
+                minimize(determinize(build().reverse()))
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                print ("%8d %6s %10d %10d %12.1f %10d %10d %12.1f %10d" % (size, path, before[0], before[1], t_build * 1000,
+                                                                        after[0], after[1], t_min * 1000, peak / 1024))
+        parsesrgs.TRIE_THRESHOLD = threshold
+
+    #
+    #  bounded repeats (unrolled) and open repeats (loop) of digits
+    #
+    def run_repeat(self):
+        from parsesrgs import SRGS, arcstats, determinize, minimize
+        opts = self._opts
+        print ("%8s %10s %10s %12s %10s %10s %12s" % ("repeat", "states", "arcs", "build(ms)",
+                                                    "min-states", "min-arcs", "minimize(ms)"))
+        specs = ["0-%d" % (n,) for n in opts.sizes] + ["%d" % (n,) for n in opts.sizes] + ["0-", "1-", "%d-" % (opts.sizes[-1],)]
+        for spec in specs:
+            gfile = os.path.join(self._tmpdir, "repeat.grxml")
+            with open(gfile, 'w', encoding='utf-8') as f:
+                f.write(repeat_grammar(spec))
+            srgs = SRGS(gfile)
+            def build():
+                srgs._fragments.clear()
+                return srgs.build('main')
+            t_build, dfa = self.measure(build)
+            revdfa = dfa.reverse()
+            t_min, mindfa = self.measure(lambda: minimize(determinize(revdfa)))
+            before = arcstats(revdfa)
+            after = arcstats(mindfa)
+            print ("%8s %10d %10d %12.2f %10d %10d %12.2f" % (spec, before[0], before[1], t_build * 1000,
+                                                            after[0], after[1], t_min * 1000))
+
+    #
+    #  memory of the parse tree and the automaton of a grammar of about
+    #  'arcs' arcs (python objects traced by tracemalloc)
+    #
+    def run_memory(self, arcs):
+        import tracemalloc, gc
+        from parsesrgs import SRGS
+        size = max(arcs * 10 // 56, 1)
+        gfile = self.mkgrammar(size)
+
+        gc.collect()
+        tracemalloc.start()
+        base = tracemalloc.get_traced_memory()[0]
+        srgs = SRGS(gfile)
+        tree = tracemalloc.get_traced_memory()[0] - base
+
+        base = tracemalloc.get_traced_memory()[0]
+        dfa = srgs.build('main')
+        compact = tracemalloc.get_traced_memory()[0] - base
+
+        base = tracemalloc.get_traced_memory()[0]
+        tuples = list(dfa.arcs())
+        listsize = tracemalloc.get_traced_memory()[0] - base
+        del tuples, dfa
+
+        base = tracemalloc.get_traced_memory()[0]
+        srgs.droptree()
+        gc.collect()
+        released = base - tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        dfa = srgs.build('main')
+        print ("slots:                    %d" % (size,))
+        print ("arcs:                     %d" % (len(dfa),))
+        print ("parse tree:               %d KB" % (tree / 1024,))
+        print ("automaton (array):        %d KB (with rule fragments)" % (compact / 1024,))
+        print ("automaton (list/tuple):   %d KB" % (listsize / 1024,))
+        print ("released by droptree():   %d KB" % (released / 1024,))
+
+__doc__ = 'Measure compile time of synthetic W3C-SRGS grammars of increasing size.'
+
+def main():
+    import utils
+
+    parser = utils.MyParser(version=__version__, usage="%prog [options]",
+                            description=__doc__)
+    parser.add_option('-s', '--sizes', dest='sizes', default='100,200,400,800,1600',
+                      help='comma separated numbers of slots (default: 100,200,400,800,1600)')
+    parser.add_option('-a', '--alternatives', dest='alternatives', type="int", default=3,
+                      help='words in each one-of (default: 3)')
+    parser.add_option('-r', '--repeat', dest='repeat', type="int", default=3,
+                      help='runs per size, the best is reported (default: 3)')
+    parser.add_option('-o', '--oneof', dest='oneof', action='store_true', default=False,
+                      help='measure one-of lists of the given numbers of entries instead')
+    parser.add_option('-R', '--repeats', dest='repeats', action='store_true', default=False,
+                      help='measure digits repeated the given numbers of times instead')
+    parser.add_option('-m', '--memory', dest='memory', type="int", default=0,
+                      help='measure memory of a grammar of about the given number of arcs instead')
+    parser.add_option('-l', '--lexicon', dest='lexicon', action="store", type="string",
+                      help='measure lookup of the words of grammars of the given numbers of rules '
+                           'in the lexicon database of the language (en or ja) instead')
+    parser.add_option('-b', '--backend', dest='backend', default='sqlite',
+                      help='lexicon backend for --lexicon: sqlite or mmap (default: sqlite)')
+    parser.add_option('-f', '--full', dest='full', action='store_true', default=False,
+                      help='also measure the whole compile including lexicon lookup')
+    try:
+        opts, args = parser.parse_args()
+    except optparse.OptionError as e:
+        print ('OptionError:', e, file=sys.stderr)
+        sys.exit(1)
+    opts.sizes = [int(s) for s in opts.sizes.split(',')]
+
+    if opts.lexicon:
+        GrammarBench(opts).run_lexicon(opts.lexicon)
+    elif opts.memory > 0:
+        GrammarBench(opts).run_memory(opts.memory)
+    elif opts.repeats:
+        GrammarBench(opts).run_repeat()
+    elif opts.oneof:
+        GrammarBench(opts).run_oneof()
+    else:
+        GrammarBench(opts).run()
+
+if __name__ == '__main__':
+    main()
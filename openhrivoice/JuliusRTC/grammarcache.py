@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''Persistent cache of compiled Julius grammars
+
+Copyright (C) 2019
+    Isao Hara
+    National Institute of Advanced Industrial Science and Technology (AIST),
+    Japan
+    All rights reserved.
+
+Licensed under the Eclipse Public License -v 1.0 (EPL)
+http://www.opensource.org/licenses/eclipse-1.0.txt
+'''
+
+import sys, os, hashlib, tempfile, time
+import optparse
+
+from __init__ import __version__
+from config import config
+
+#
+#  default limits of the grammar cache (files unused for MAX_AGE sec are
+#  removed, then the least recently used files over MAX_BYTES)
+#
+MAX_AGE = 30 * 24 * 3600
+MAX_BYTES = 64 * 1024 * 1024
+
+#
+#  Grammar cache class
+#    one file per rule: <cachedir>/<key>-<hash of rule id>.julius
+#    mtime of a file is the time it was last used.
+#
+class GrammarCache:
+    ''' Utility class to store compiled grammar (DFA/dict text) of each rule'''
+    #
+    #  Constructor
+    #
+    def __init__(self, cachedir=None, maxage=MAX_AGE, maxbytes=MAX_BYTES):
+        if cachedir is None:
+            cachedir = config()._grammarcachedir
+        self._cachedir = cachedir
+        self._maxage = maxage
+        self._maxbytes = maxbytes
+        if not os.path.exists(self._cachedir):
+            os.makedirs(self._cachedir)
+        self.hits = 0
+        self.misses = 0
+
+    #
+    #  compute cache key of the grammar
+    #    files   : grammar file, XIncluded parts and lexicons
+    #    versions: lexicon db version, converter version, ...
+    #
+    def key(self, files, versions):
+        h = hashlib.sha1()
+        for v in versions:
+            h.update(str(v).encode('utf-8'))
+            h.update(b'\0')
+        for f in files:
+            h.update(os.path.abspath(f).encode('utf-8'))
+            h.update(b'\0')
+            with open(f, 'rb') as fp:
+                h.update(hashlib.sha1(fp.read()).digest())
+        return h.hexdigest()
+
+    #
+    #
+    def filename(self, key, rule):
+        return os.path.join(self._cachedir, "%s-%s.julius" % (key, hashlib.sha1(rule.encode('utf-8')).hexdigest()[:16]))
+
+    #
+    #  get compiled grammar (None if not cached)
+    #
+    def get(self, key, rule):
+        fname = self.filename(key, rule)
+        try:
+            with open(fname, 'r', encoding='utf-8') as f:
+                data = f.read()
+            os.utime(fname, None)
+            self.hits += 1
+            return data
+        except (IOError, OSError):
+            self.misses += 1
+            return None
+
+    #
+    #  store compiled grammar
+    #
+    def put(self, key, rule, data):
+        fname = self.filename(key, rule)
+        try:
+            fd, tmpname = tempfile.mkstemp(dir=self._cachedir)
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(data)
+            os.replace(tmpname, fname)
+        except (IOError, OSError) as e:
+            print ("[warning] unable to write grammar cache: ", fname)
+            print (e)
+
+    #
+    #  remove cached grammars unused for maxage sec, then the least recently
+    #  used ones until the total size is not more than maxbytes
+    #    returns number of removed files
+    #
+    def prune(self):
+        entries = []
+        for f in os.listdir(self._cachedir):
+            if f.endswith('.julius'):
+                fname = os.path.join(self._cachedir, f)
+                try:
+                    st = os.stat(fname)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, fname))
+        entries.sort(reverse=True)
+        now = time.time()
+        total = 0
+        removed = 0
+        for (mtime, size, fname) in entries:
+            if ((self._maxage > 0 and now - mtime > self._maxage) or
+                (self._maxbytes > 0 and total + size > self._maxbytes)):
+                try:
+                    os.remove(fname)
+                    removed += 1
+                except OSError:
+                    pass
+            else:
+                total += size
+        return removed
+
+    #
+    #  remove all cached grammars
+    #
+    def clear(self):
+        for f in os.listdir(self._cachedir):
+            if f.endswith('.julius'):
+                os.remove(os.path.join(self._cachedir, f))
+
+    #
+    #  cache statistics
+    #
+    def stats(self):
+        files = [f for f in os.listdir(self._cachedir) if f.endswith('.julius')]
+        size = sum([os.path.getsize(os.path.join(self._cachedir, f)) for f in files])
+        total = self.hits + self.misses
+        return { 'hits': self.hits, 'misses': self.misses,
+                 'hitrate': (float(self.hits) / total if total > 0 else 0.0),
+                 'entries': len(files), 'bytes': size }
+
+#
+#  grammar cache of the configuration (None if julius.grammar_cache is off)
+#    julius.grammar_cache_dir : cache directory (default: ~/.openhri/grammar_cache)
+#    julius.grammar_cache_size: max size in MB
+#
+def opencache(prop=None, cachedir=None):
+    maxbytes = MAX_BYTES
+    if prop :
+        if prop.getProperty("julius.grammar_cache") == "off":
+            return None
+        if cachedir is None and prop.getProperty("julius.grammar_cache_dir") :
+            cachedir = os.path.expanduser(prop.getProperty("julius.grammar_cache_dir"))
+        if prop.getProperty("julius.grammar_cache_size") :
+            maxbytes = int(float(prop.getProperty("julius.grammar_cache_size")) * 1024 * 1024)
+    return GrammarCache(cachedir, maxbytes=maxbytes)
+
+__doc__ = 'Pre-compile W3C-SRGS grammars into the grammar cache of JuliusRTC.'
+
+def main():
+    from parsesrgs import SRGS
+    import utils
+
+    parser = utils.MyParser(version=__version__, usage="%prog [grammarfiles]",
+                            description=__doc__)
+    parser.add_option('-d', '--cache-dir', dest='cachedir', action="store",
+                      type="string", default=None,
+                      help='specify cache directory (default: julius.grammar_cache_dir or ~/.openhri/grammar_cache)')
+    parser.add_option('-f', '--conf', dest='conf', action="store",
+                      type="string", default=None,
+                      help='read julius.* settings of JuliusRTC from the configuration file (julius.conf)')
+    parser.add_option('-b', '--backend', dest='backend', action="store",
+                      type="string", default=None,
+                      help='lexicon backend: sqlite or mmap (default: julius.lexicon_backend)')
+    parser.add_option('-v', '--max-variants', dest='maxvariants', type="int", default=None,
+                      help='max number of segmented pronunciations (default: julius.lexicon_max_variants)')
+    parser.add_option('-c', '--clear', dest='clear', action='store_true',
+                      default=False,
+                      help='remove all cached grammars before compiling')
+    parser.add_option('-j', '--jobs', dest='jobs', type="int", default=1,
+                      help='number of processes compiling rules (default: 1)')
+    parser.add_option('-s', '--stats', dest='stats', action='store_true',
+                      default=False,
+                      help='show cache statistics')
+    parser.add_option('-p', '--prune', dest='prune', action='store_true',
+                      default=False,
+                      help='remove old cached grammars over the size limit')
+    try:
+        opts, args = parser.parse_args()
+    except optparse.OptionError as e:
+        print ('OptionError:', e, file=sys.stderr)
+        sys.exit(1)
+
+    if len(args) == 0 and not opts.stats and not opts.clear and not opts.prune:
+        parser.error("wrong number of arguments")
+        sys.exit(1)
+
+    prop = utils.ConfProperties(opts.conf)
+    if opts.backend :
+        prop['julius.lexicon_backend'] = opts.backend
+    if opts.maxvariants is not None:
+        prop['julius.lexicon_max_variants'] = str(opts.maxvariants)
+    cache = opencache(prop, opts.cachedir)
+    if cache is None:
+        print ("[error] julius.grammar_cache is off in %s" % (opts.conf,))
+        sys.exit(1)
+    if opts.clear:
+        cache.clear()
+    if opts.prune:
+        print ("removed %d cached grammars" % (cache.prune(),))
+
+    for a in args:
+        srgs = SRGS(a, prop, cache=cache)
+        for (r, data) in srgs.toJuliusAll(jobs=opts.jobs):
+            print ("%s: %s (%.1f msec)" % (a, r, srgs._compiletimes[r] * 1000))
+
+    if opts.stats:
+        for (k, v) in cache.stats().items():
+            print ("%s: %s" % (k, v))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''Watcher of grammar files for hot-reload
+
+Copyright (C) 2019
+    Isao Hara
+    National Institute of Advanced Industrial Science and Technology (AIST),
+    Japan
+    All rights reserved.
+
+Licensed under the Eclipse Public License -v 1.0 (EPL)
+http://www.opensource.org/licenses/eclipse-1.0.txt
+'''
+
+import os, threading, traceback
+
+#
+#  Grammar watcher thread
+#    polls mtime and size of the grammar file, its XIncludes and lexicons
+#    and calls 'callback' when they changed and stayed unchanged for one
+#    more interval (so that half-written files are not read).
+#
+class GrammarWatcher(threading.Thread):
+    #
+    #  Constructor
+    #    files   : files to be watched (SRGS.dependencies())
+    #    callback: function called on change, returns new list of files or None
+    #    interval: polling interval in seconds
+    #
+    def __init__(self, files, callback, interval=1.0):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self._callback = callback
+        self._interval = interval
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self.setfiles(files)
+
+    #
+    #  (mtime, size) of each file (None if missing)
+    #
+    def stamps(self, files):
+        st = {}
+        for f in files:
+            try:
+                s = os.stat(f)
+                st[f] = (s.st_mtime, s.st_size)
+            except OSError:
+                st[f] = None
+        return st
+
+    def setfiles(self, files):
+        with self._lock:
+            self._files = list(files)
+            self._stamps = self.stamps(self._files)
+
+    #
+    #  Run
+    #
+    def run(self):
+        pending = None
+        while not self._stopped.wait(self._interval):
+            with self._lock:
+                files = self._files
+                old = self._stamps
+            st = self.stamps(files)
+            if st == old:
+                pending = None
+                continue
+            if st != pending:
+                pending = st
+                continue
+            pending = None
+            with self._lock:
+                self._stamps = st
+            if self._stopped.is_set():
+                break
+            try:
+                files = self._callback()
+            except Exception:
+                print ("[error] failed to reload grammar")
+                traceback.print_exc()
+                files = None
+            if files is not None:
+                self.setfiles(files)
+
+    #
+    #  stop watching (the reload in progress is not interrupted)
+    #
+    def terminate(self):
+        self._stopped.set()
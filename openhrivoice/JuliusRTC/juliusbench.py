@@ -0,0 +1,329 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''End-to-end benchmark of JuliusWrap with a local Julius stand-in
+
+Copyright (C) 2019
+    Isao Hara
+    National Institute of Advanced Industrial Science and Technology (AIST),
+    Japan
+    All rights reserved.
+
+Licensed under the Eclipse Public License -v 1.0 (EPL)
+http://www.opensource.org/licenses/eclipse-1.0.txt
+'''
+
+import sys, os, socket, struct, threading, multiprocessing
+import time, optparse
+
+from __init__ import __version__
+from juliusevents import *
+
+#
+#  recorded messages of Julius replayed by FakeJulius
+#
+def recorded_messages():
+    msgs = [m for m in SAMPLE_OUTPUT.split(".\n") if m.strip()]
+    recogout = [m for m in msgs if m.startswith("<RECOGOUT>")][0]
+    return recogout
+
+GRAMINFO = u'''<GRAMINFO>
+ #  0: [active]   12 words,  12 categories,   20 nodes (new)
+</GRAMINFO>
+'''
+
+#
+#  Fake Julius server: module mode protocol and adinnet sink
+#    utterance_bytes of audio are followed by silence_bytes. STARTREC and
+#    ENDREC are sent at the boundaries and RECOGOUT after 'delay' seconds.
+#
+class FakeJulius:
+    #
+    #  Constructor
+    #
+    def __init__(self, utterance_bytes, silence_bytes, delay=0.0, ready_delay=0.0):
+        self._utterance_bytes = utterance_bytes
+        self._silence_bytes = silence_bytes
+        self._delay = delay
+        self._ready_delay = ready_delay
+        self._recogout = recorded_messages().encode('utf-8')
+        self._msock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._msock.bind(('localhost', 0))
+        self._msock.listen(1)
+        self._asock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._asock.bind(('localhost', 0))
+        self._asock.listen(1)
+        self._lock = threading.Lock()
+        self._module = None
+
+    def ports(self):
+        return (self._msock.getsockname()[1], self._asock.getsockname()[1])
+
+    #
+    #  send one message to the module client
+    #
+    def send(self, msg):
+        with self._lock:
+            try:
+                self._module.sendall(msg + b".\n")
+            except (socket.error, AttributeError):
+                pass
+
+    def send_later(self, delay, msg):
+        if delay > 0:
+            th = threading.Timer(delay, self.send, (msg,))
+            th.daemon = True
+            th.start()
+        else:
+            self.send(msg)
+
+    #
+    #  module mode commands
+    #
+    def module_loop(self):
+        f = self._module.makefile('rb')
+        while True:
+            l = f.readline()
+            if not l:
+                break
+            cmd = l.decode('utf-8').strip().split(' ')[0]
+            if cmd in ('CHANGEGRAM', 'ADDGRAM'):
+                while True:
+                    l = f.readline()
+                    if not l or l.startswith(b"DICEND"):
+                        break
+                self.send(b'<GRAMMAR STATUS="RECEIVED"/>\n')
+            elif cmd == 'SYNCGRAM':
+                self.send_later(self._ready_delay, b'<GRAMMAR STATUS="READY"/>\n')
+            elif cmd == 'GRAMINFO':
+                self.send(GRAMINFO.encode('utf-8'))
+            elif cmd == 'DIE':
+                break
+
+    #
+    #  adinnet sink
+    #
+    def adinnet_loop(self, sock):
+        f = sock.makefile('rb')
+        total = 0
+        period = self._utterance_bytes + self._silence_bytes
+        while True:
+            h = f.read(4)
+            if len(h) < 4:
+                break
+            n = struct.unpack("i", h)[0]
+            if n <= 0:
+                continue
+            data = f.read(n)
+            if len(data) < n:
+                break
+            before = total % period
+            total += n
+            after = before + n
+            if before == 0:
+                self.send(('<INPUT STATUS="STARTREC" TIME="%d"/>\n' % (time.time(),)).encode('utf-8'))
+            if before < self._utterance_bytes <= after:
+                self.send(('<INPUT STATUS="ENDREC" TIME="%d"/>\n' % (time.time(),)).encode('utf-8'))
+                self.send_later(self._delay, self._recogout)
+
+    #
+    #  Run (in a separated process)
+    #
+    def run(self):
+        self._module, addr = self._msock.accept()
+        self.send(b'<STARTPROC/>\n')
+        asock, addr = self._asock.accept()
+        self.send(('<INPUT STATUS="LISTEN" TIME="%d"/>\n' % (time.time(),)).encode('utf-8'))
+        th = threading.Thread(target=self.adinnet_loop, args=(asock,))
+        th.daemon = True
+        th.start()
+        self.module_loop()
+
+def fakejulius_proc(conn, utterance_bytes, silence_bytes, delay, ready_delay):
+    j = FakeJulius(utterance_bytes, silence_bytes, delay, ready_delay)
+    conn.send(j.ports())
+    j.run()
+
+#
+#  Properties given to JuliusWrap instead of rtc.conf
+#
+class BenchProperties:
+    def __init__(self, values):
+        self._values = values
+
+    def getProperty(self, name):
+        return self._values.get(name, "")
+
+class BenchManager:
+    def __init__(self, values):
+        self._config = BenchProperties(values)
+
+class BenchRTC:
+    def __init__(self, values):
+        self._mode = 'client'
+        self._jconf_file = ['']
+        self._manager = BenchManager(values)
+
+#
+#  percentile of sorted list
+#
+def percentile(values, p):
+    if len(values) == 0:
+        return 0.0
+    k = min(int(round(p / 100.0 * (len(values) - 1))), len(values) - 1)
+    return values[k]
+
+#
+#  Benchmark
+#
+class JuliusBench:
+    #
+    #  Constructor
+    #
+    def __init__(self, opts):
+        self._opts = opts
+        self._bytes_per_sec = 16000 * 2
+        self._packet_bytes = int(self._bytes_per_sec * opts.packet_ms / 1000.0)
+        self._utterance_bytes = int(self._bytes_per_sec * opts.utterance_sec)
+        self._silence_bytes = int(self._bytes_per_sec * opts.silence_sec)
+        self._results = []
+        self._endtimes = []
+        self._done = threading.Event()
+
+    #
+    #  Callback from JuliusWrap
+    #
+    def onResult(self, type, data):
+        if type == JuliusWrap.CB_DOCUMENT and isinstance(data, RecogoutEvent):
+            listentext(hypotheses(data)).encode('utf-8').decode('unicode_escape')
+            self._results.append(time.time())
+            if len(self._results) >= self._opts.utterances:
+                self._done.set()
+
+    #
+    #  synthetic grammars for activation time
+    #
+    def grammars(self):
+        if self._opts.grammar:
+            from parsesrgs import SRGS
+            srgs = SRGS(self._opts.grammar)
+            return [(r, srgs.toJulius(r)) for r in srgs._rules.keys()]
+        gram = u"0 1 1 0 0\n1 0 2 0 0\n2 -1 -1 1 0\nDFAEND\n0\t[<s>]\tsil\n1\t[</s>]\tsil\nDICEND\n"
+        return [("rule%d" % (i,), gram) for i in range(self._opts.rules)]
+
+    #
+    #  send synthetic audio
+    #
+    def sendaudio(self, j):
+        packet = b'\0' * self._packet_bytes
+        period = self._utterance_bytes + self._silence_bytes
+        interval = 0.0
+        if self._opts.rate > 0:
+            interval = self._opts.packet_ms / 1000.0 / self._opts.rate
+        sent = 0
+        next_t = time.time()
+        for u in range(self._opts.utterances):
+            start = sent
+            while sent - start < period:
+                before = sent - start
+                n = min(self._packet_bytes, period - before)
+                j.write(packet[:n])
+                sent += n
+                if before < self._utterance_bytes <= before + n:
+                    self._endtimes.append(time.time())
+                if interval > 0:
+                    next_t += interval
+                    d = next_t - time.time()
+                    if d > 0:
+                        time.sleep(d)
+
+    #
+    #  Run
+    #
+    def run(self):
+        opts = self._opts
+        conn, child = multiprocessing.Pipe()
+        p = multiprocessing.Process(target=fakejulius_proc,
+                                    args=(child, self._utterance_bytes, self._silence_bytes,
+                                          opts.delay, opts.ready_delay))
+        p.daemon = True
+        p.start()
+        mport, aport = conn.recv()
+
+        rtc = BenchRTC({ "julius.module_port": str(mport), "julius.adinnet_port": str(aport),
+                         "julius.record": opts.record,
+                         "julius.adinnet_overflow": opts.overflow })
+        j = JuliusWrap('en', rtc)
+        j.start()
+        j.setcallback(self.onResult)
+        j.wait_ready()
+
+        grams = self.grammars()
+        t = time.time()
+        j.setgrammars(grams, [grams[0][0],])
+        activation = time.time() - t
+
+        cpu = time.process_time()
+        t = time.time()
+        self.sendaudio(j)
+        self._done.wait(opts.delay + 10.0 + opts.utterances * 0.1)
+        elapsed = time.time() - t
+        cpu = time.process_time() - cpu
+
+        latency = sorted([r - e for (r, e) in zip(self._results, self._endtimes)])
+        n = len(self._results)
+        print ("utterances:        %d / %d" % (n, opts.utterances))
+        print ("grammar activation: %.1f msec (%d rules)" % (activation * 1000, len(grams)))
+        print ("throughput:        %.1f utterances/sec" % (n / elapsed if elapsed > 0 else 0,))
+        print ("cpu per utterance: %.3f msec" % (cpu / n * 1000 if n > 0 else 0,))
+        for pc in (50, 90, 99, 100):
+            print ("latency p%-3d:      %.2f msec" % (pc, percentile(latency, pc) * 1000))
+        print ("module socket:     %s" % (j.stats(),))
+        print ("adinnet sender:    %s" % (j.adinnet_stats(),))
+
+        j.terminate()
+        p.join(2)
+        if p.is_alive():
+            p.terminate()
+
+__doc__ = 'Benchmark JuliusWrap against a fake Julius module-mode server.'
+
+def main():
+    global JuliusWrap
+    from JuliusRTC import JuliusWrap
+    import utils
+
+    parser = utils.MyParser(version=__version__, usage="%prog [options]",
+                            description=__doc__)
+    parser.add_option('-n', '--utterances', dest='utterances', type="int", default=100,
+                      help='number of utterances (default: 100)')
+    parser.add_option('--rate', dest='rate', type="float", default=1.0,
+                      help='audio speed relative to real time (0: as fast as possible, default: 1.0)')
+    parser.add_option('--packet-ms', dest='packet_ms', type="int", default=20,
+                      help='audio packet length in msec (default: 20)')
+    parser.add_option('--utterance-sec', dest='utterance_sec', type="float", default=1.0,
+                      help='length of each utterance (default: 1.0)')
+    parser.add_option('--silence-sec', dest='silence_sec', type="float", default=0.5,
+                      help='silence between utterances (default: 0.5)')
+    parser.add_option('--delay', dest='delay', type="float", default=0.05,
+                      help='recognition delay of fake julius after ENDREC (default: 0.05)')
+    parser.add_option('--ready-delay', dest='ready_delay', type="float", default=0.0,
+                      help='delay of grammar READY after SYNCGRAM (default: 0)')
+    parser.add_option('--rules', dest='rules', type="int", default=30,
+                      help='number of synthetic grammars registered (default: 30)')
+    parser.add_option('-g', '--grammar', dest='grammar', action="store", type="string",
+                      help='compile and register rules of the SRGS grammar instead')
+    parser.add_option('--record', dest='record', default='memory',
+                      help='julius.record mode: memory, disk or off (default: memory)')
+    parser.add_option('--overflow', dest='overflow', default='block',
+                      help='julius.adinnet_overflow policy (default: block)')
+    try:
+        opts, args = parser.parse_args()
+    except optparse.OptionError as e:
+        print ('OptionError:', e, file=sys.stderr)
+        sys.exit(1)
+
+    JuliusBench(opts).run()
+
+if __name__ == '__main__':
+    main()
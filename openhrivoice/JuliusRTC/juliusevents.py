@@ -0,0 +1,322 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''Streaming parser for Julius module mode messages
+
+Copyright (C) 2019
+    Isao Hara
+    National Institute of Advanced Industrial Science and Technology (AIST),
+    Japan
+    All rights reserved.
+
+Licensed under the Eclipse Public License -v 1.0 (EPL)
+http://www.opensource.org/licenses/eclipse-1.0.txt
+'''
+
+import sys, re, codecs, json
+
+#
+#  tokenizer for the small XML vocabulary of Julius
+#   (attribute values are not escaped by Julius, e.g. WORD="<s>")
+#
+_tag_re = re.compile(r'<(/?)([A-Za-z_][A-Za-z0-9_]*)((?:\s+[A-Za-z_][A-Za-z0-9_]*="[^"]*")*)\s*(/?)>')
+_attr_re = re.compile(r'([A-Za-z_][A-Za-z0-9_]*)="([^"]*)"')
+
+#
+#  Base class of events
+#
+class JuliusEvent:
+    def __init__(self, tag, attrs):
+        self.tag = tag
+        self.attrs = attrs
+        self.text = ''
+
+    def get(self, name, default=None):
+        return self.attrs.get(name, default)
+
+    def __getitem__(self, name):
+        return self.attrs[name]
+
+    def __repr__(self):
+        return "<%s %s>" % (self.tag, self.attrs)
+
+#
+#  <INPUT STATUS="LISTEN|STARTREC|ENDREC" TIME="..."/>
+#
+class InputEvent(JuliusEvent):
+    def __init__(self, tag, attrs):
+        JuliusEvent.__init__(self, tag, attrs)
+        self.status = attrs.get('status', '')
+        self.time = attrs.get('time', '')
+
+#
+#  <REJECTED REASON="..."/>
+#
+class RejectedEvent(JuliusEvent):
+    def __init__(self, tag, attrs):
+        JuliusEvent.__init__(self, tag, attrs)
+        self.reason = attrs.get('reason', '')
+
+#
+#  <GRAMMAR STATUS="RECEIVED|READY|ERROR" REASON="..."/>
+#
+class GrammarEvent(JuliusEvent):
+    def __init__(self, tag, attrs):
+        JuliusEvent.__init__(self, tag, attrs)
+        self.status = attrs.get('status', '')
+        self.reason = attrs.get('reason', '')
+
+#
+#  <GRAMINFO> ... </GRAMINFO>
+#
+class GraminfoEvent(JuliusEvent):
+    pass
+
+#
+#  <WHYPO WORD="..." CLASSID="..." PHONE="..." CM="..."/>
+#
+class Whypo:
+    def __init__(self, attrs):
+        self.attrs = attrs
+        self.word = attrs.get('word', '')
+        self.cm = attrs.get('cm', '')
+
+    def __getitem__(self, name):
+        return self.attrs[name]
+
+#
+#  <SHYPO RANK="..." SCORE="..." GRAM="..."> <WHYPO .../>... </SHYPO>
+#
+class Shypo:
+    def __init__(self, attrs):
+        self.attrs = attrs
+        self.rank = attrs.get('rank', '')
+        self.score = attrs.get('score', '')
+        self.words = []
+
+    def __getitem__(self, name):
+        return self.attrs[name]
+
+#
+#  <RECOGOUT> <SHYPO>...</SHYPO>... </RECOGOUT>
+#
+class RecogoutEvent(JuliusEvent):
+    def __init__(self, tag, attrs):
+        JuliusEvent.__init__(self, tag, attrs)
+        self.shypos = []
+
+_event_classes = {
+    'INPUT': InputEvent,
+    'REJECTED': RejectedEvent,
+    'GRAMMAR': GrammarEvent,
+    'GRAMINFO': GraminfoEvent,
+    'RECOGOUT': RecogoutEvent,
+}
+
+#
+#  Parse one message (text between ".\n" delimiters)
+#
+def parsemessage(msg):
+    event = None
+    shypo = None
+    pos = 0
+    for m in _tag_re.finditer(msg):
+        closing, tag, attrstr, empty = m.groups()
+        tag = tag.upper()
+        if event is not None and m.start() > pos:
+            event.text += msg[pos:m.start()]
+        pos = m.end()
+        if closing:
+            if tag == 'SHYPO':
+                shypo = None
+            continue
+        attrs = dict((k.lower(), v) for (k, v) in _attr_re.findall(attrstr))
+        if event is None:
+            event = _event_classes.get(tag, JuliusEvent)(tag, attrs)
+        elif tag == 'SHYPO' and isinstance(event, RecogoutEvent):
+            shypo = Shypo(attrs)
+            event.shypos.append(shypo)
+        elif tag == 'WHYPO' and shypo is not None:
+            shypo.words.append(Whypo(attrs))
+    return event
+
+#
+#  Incremental parser: socket stream -> list of events
+#
+class JuliusStreamParser:
+    #
+    #  Constructor
+    #
+    def __init__(self, encoding='utf-8'):
+        self._decoder = codecs.getincrementaldecoder(encoding)('replace')
+        self._buffer = ''
+
+    #
+    #  feed bytes received from the module socket
+    #
+    def feed(self, data):
+        self._buffer += self._decoder.decode(data)
+        ds = self._buffer.split(".\n")
+        self._buffer = ds[-1]
+        events = []
+        for d in ds[:-1]:
+            ev = parsemessage(d)
+            if ev is not None:
+                events.append(ev)
+        return events
+
+    #
+    #  clear partial message
+    #
+    def reset(self):
+        self._decoder.reset()
+        self._buffer = ''
+
+#
+#  Summary of n-best hypotheses in RECOGOUT
+#    [(rank, score, likelihood, [(word, cm), ...]), ...]
+#    score is the average of confidence measures
+#
+def hypotheses(ev):
+    result = []
+    for s in ev.shypos:
+        words = []
+        score = 0
+        for w in s.words:
+            if not w.word or w.word[0] == '<':
+                continue
+            words.append((w.word, w.cm))
+            score += float(w.cm)
+        if len(words) > 0:
+            score = score / len(words)
+        result.append((s.rank, score, s.score, words))
+    return result
+
+def _escape(text):
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace("\"", "&quot;").replace(">", "&gt;")
+
+#
+#  listenText XML (same as xml.dom.minidom toxml(encoding="utf-8"))
+#
+def listentext(hypos):
+    out = [u'<?xml version="1.0" encoding="utf-8"?>']
+    if len(hypos) == 0:
+        out.append(u'<listenText/>')
+        return u''.join(out)
+    out.append(u'<listenText>')
+    for (rank, score, likelihood, words) in hypos:
+        out.append(u'<data rank="%s" score="%s" likelihood="%s" text="%s"' %
+                   (_escape(rank), _escape(str(score)), _escape(likelihood), _escape(u" ".join([w for (w, cm) in words]))))
+        if len(words) == 0:
+            out.append(u'/>')
+            continue
+        out.append(u'>')
+        for (w, cm) in words:
+            out.append(u'<word text="%s" score="%s"/>' % (_escape(w), _escape(cm)))
+        out.append(u'</data>')
+    out.append(u'</listenText>')
+    return u''.join(out)
+
+#
+#  compact JSON of the n-best hypotheses
+#
+def listenjson(hypos):
+    data = []
+    for (rank, score, likelihood, words) in hypos:
+        data.append({'rank': int(rank), 'score': score, 'likelihood': float(likelihood),
+                     'text': u" ".join([w for (w, cm) in words]),
+                     'words': [{'text': w, 'score': float(cm)} for (w, cm) in words]})
+    return json.dumps({'hypotheses': data}, separators=(',', ':'))
+
+#
+#  Recorded output of Julius (for micro-benchmark)
+#
+SAMPLE_OUTPUT = u'''<INPUT STATUS="LISTEN" TIME="1561000000"/>
+.
+<INPUT STATUS="STARTREC" TIME="1561000001"/>
+.
+<STARTRECOG/>
+.
+<INPUT STATUS="ENDREC" TIME="1561000002"/>
+.
+<ENDRECOG/>
+.
+<INPUTPARAM FRAMES="138" MSEC="1380"/>
+.
+<RECOGOUT>
+  <SHYPO RANK="1" SCORE="-3457.250000" GRAM="0">
+    <WHYPO WORD="<s>" CLASSID="0" PHONE="silB" CM="1.000"/>
+    <WHYPO WORD="りんご" CLASSID="5" PHONE="r i N g o" CM="0.953"/>
+    <WHYPO WORD="を" CLASSID="9" PHONE="o" CM="0.870"/>
+    <WHYPO WORD="取って" CLASSID="11" PHONE="t o q t e" CM="0.912"/>
+    <WHYPO WORD="</s>" CLASSID="1" PHONE="silE" CM="1.000"/>
+  </SHYPO>
+  <SHYPO RANK="2" SCORE="-3461.113281" GRAM="0">
+    <WHYPO WORD="<s>" CLASSID="0" PHONE="silB" CM="1.000"/>
+    <WHYPO WORD="みかん" CLASSID="6" PHONE="m i k a N" CM="0.032"/>
+    <WHYPO WORD="を" CLASSID="9" PHONE="o" CM="0.870"/>
+    <WHYPO WORD="取って" CLASSID="11" PHONE="t o q t e" CM="0.912"/>
+    <WHYPO WORD="</s>" CLASSID="1" PHONE="silE" CM="1.000"/>
+  </SHYPO>
+  <SHYPO RANK="3" SCORE="-3470.500000" GRAM="0">
+    <WHYPO WORD="<s>" CLASSID="0" PHONE="silB" CM="1.000"/>
+    <WHYPO WORD="りんご" CLASSID="5" PHONE="r i N g o" CM="0.953"/>
+    <WHYPO WORD="取って" CLASSID="11" PHONE="t o q t e" CM="0.088"/>
+    <WHYPO WORD="</s>" CLASSID="1" PHONE="silE" CM="1.000"/>
+  </SHYPO>
+  <SHYPO RANK="4" SCORE="-3475.000000" GRAM="0">
+    <WHYPO WORD="<s>" CLASSID="0" PHONE="silB" CM="1.000"/>
+    <WHYPO WORD="ピザ" CLASSID="7" PHONE="p i z a" CM="0.010"/>
+    <WHYPO WORD="を" CLASSID="9" PHONE="o" CM="0.870"/>
+    <WHYPO WORD="取って" CLASSID="11" PHONE="t o q t e" CM="0.912"/>
+    <WHYPO WORD="</s>" CLASSID="1" PHONE="silE" CM="1.000"/>
+  </SHYPO>
+  <SHYPO RANK="5" SCORE="-3480.750000" GRAM="0">
+    <WHYPO WORD="<s>" CLASSID="0" PHONE="silB" CM="1.000"/>
+    <WHYPO WORD="みかん" CLASSID="6" PHONE="m i k a N" CM="0.005"/>
+    <WHYPO WORD="取って" CLASSID="11" PHONE="t o q t e" CM="0.088"/>
+    <WHYPO WORD="</s>" CLASSID="1" PHONE="silE" CM="1.000"/>
+  </SHYPO>
+</RECOGOUT>
+.
+'''
+
+#
+#  Micro-benchmark: streaming parser vs. BeautifulSoup per message
+#
+def benchmark(count=1000, chunksize=1024):
+    import time
+    data = (SAMPLE_OUTPUT * count).encode('utf-8')
+    chunks = [data[i:i+chunksize] for i in range(0, len(data), chunksize)]
+
+    start = time.time()
+    parser = JuliusStreamParser('utf-8')
+    nevents = 0
+    for c in chunks:
+        nevents += len(parser.feed(c))
+    t_stream = time.time() - start
+    print ("JuliusStreamParser: %d events, %.3f sec (%.1f usec/event)" % (nevents, t_stream, t_stream / nevents * 1e6))
+
+    try:
+        from bs4 import BeautifulSoup
+    except ImportError:
+        return
+    start = time.time()
+    prevdata = ''
+    nevents = 0
+    for c in chunks:
+        data = prevdata + c.decode('utf-8', 'replace')
+        ds = data.split(".\n")
+        prevdata = ds[-1]
+        for d in ds[:-1]:
+            BeautifulSoup(d, "lxml")
+            nevents += 1
+    t_soup = time.time() - start
+    print ("BeautifulSoup:      %d events, %.3f sec (%.1f usec/event)" % (nevents, t_soup, t_soup / nevents * 1e6))
+    print ("speedup: x%.1f" % (t_soup / t_stream,))
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        benchmark(int(sys.argv[1]))
+    else:
+        benchmark()
@@ -14,6 +14,8 @@ http://www.opensource.org/licenses/eclipse-1.0.txt
 '''
 
 import sqlite3
+import time
+import collections
 
 from __init__ import __version__
 
@@ -22,19 +24,242 @@ from parsejuliusdict import *
 from parsevoxforgedict import *
 
 #
-#  Lexicon Database class
+#  number of rows inserted by one executemany() on rebuild
 #
-class LexiconDB:
-    ''' Utility class to store pronunciation dictionary to database'''
+BATCH_SIZE = 10000
+
+#
+#  max number of words kept in the lookup caches of LexiconDB
+#
+LOOKUP_CACHE_SIZE = 20000
+
+#
+#  max number of pronunciations of a word segmented by substringlookup
+#  (0 or less: no limit)
+#
+MAX_VARIANTS = 16
+
+#
+#  max number of words in one query of lookup_many
+#
+QUERY_CHUNK_SIZE = 500
+
+#
+#  Bounded cache of the least recently used entries
+#
+class LRUCache:
+    def __init__(self, maxsize):
+        self._maxsize = maxsize
+        self._data = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    #
+    #  cached value (None if not cached)
+    def get(self, key):
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    #
+    #  cached value without counting a hit or miss (for internal probes)
+    def peek(self, key):
+        value = self._data.get(key)
+        if value is not None:
+            self._data.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        if self._maxsize <= 0:
+            return
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self._maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return { 'hits': self.hits, 'misses': self.misses,
+                 'hitrate': (float(self.hits) / total if total > 0 else 0.0),
+                 'entries': len(self._data) }
+
+#
+#  max number of segmented pronunciations (julius.lexicon_max_variants)
+#
+def maxvariants_of(prop, default=MAX_VARIANTS):
+    if prop and prop.getProperty("julius.lexicon_max_variants") :
+        return int(prop.getProperty("julius.lexicon_max_variants"))
+    return default
+
+#
+#  Base class of lexicon backends
+#    lookup and segmentation of words with the caches. backends implement
+#      query(text)      : pronunciations of the word
+#      querymany(texts) : {word: [pronunciation, ...]} of the words found
+#      knownwords(texts): the words of 'texts' in the lexicon
+#      maxlength()      : length of the longest word
+#      keys()           : all words
+#
+class Lexicon:
     #
     #  Constructor
     #
-    def __init__(self, fname, version, prop=None, rebuid=False):
+    def __init__(self, prop=None, cachesize=LOOKUP_CACHE_SIZE, maxvariants=MAX_VARIANTS):
         self._config = config()
+        self._lookupcache = LRUCache(cachesize)
+        self._substringcache = LRUCache(cachesize)
+        self._maxvariants = maxvariants_of(prop, maxvariants)
+        self._maxlength = None
+        self._queries = 0
         if prop :
             if prop.getProperty("julius.3rdparty_dir") :
                 self._config.julius(prop.getProperty("julius.3rdparty_dir"))
 
+    #
+    #  (word, pronunciation, alphabet) of the dictionaries of Julius
+    def entries(self):
+        for (t, v) in voxforge_entries(self._config._julius_dict_en):
+            yield (t.lower(), v, 'ARPAbet')
+        for (t, v) in juliusdict_entries(self._config._julius_dict_ja):
+            yield (t, v, 'KANA')
+
+    def clearcache(self):
+        self._lookupcache.clear()
+        self._substringcache.clear()
+        self._maxlength = None
+
+    #
+    #  pronunciations of the word
+    def lookup(self, text):
+        text = text.lower()
+        p = self._lookupcache.get(text)
+        if p is None:
+            p = tuple(sorted(set(self.query(text))))
+            self._lookupcache.put(text, p)
+        return list(p)
+
+    #
+    #  pronunciations of the words {word: [pronunciation, ...]}
+    #    words not in the cache are looked up by querymany() at once.
+    def lookup_many(self, words):
+        result = {}
+        query = {}
+        for w in words:
+            text = w.lower()
+            p = self._lookupcache.get(text)
+            if p is None:
+                try:
+                    query[text].append(w)
+                except KeyError:
+                    query[text] = [w,]
+            else:
+                result[w] = list(p)
+        if len(query) > 0:
+            found = self.querymany(list(query.keys()))
+            for (text, ws) in query.items():
+                p = tuple(sorted(set(found.get(text, ()))))
+                self._lookupcache.put(text, p)
+                for w in ws:
+                    result[w] = list(p)
+        return result
+
+    #
+    #  pronunciations of the word as concatenation of known words
+    #    the longest known word at the head is taken if the rest can be
+    #    segmented too. pronunciations of the rests are memoized in the
+    #    substring cache shared by all calls.
+    def substringlookup(self, text):
+        p = self._substringcache.get(text)
+        if p is None:
+            p = self.segmentlookup(text, {})
+        return list(p)
+
+    def segmentlookup(self, text, memo):
+        if len(text) == 0:
+            return (u'',)
+        try:
+            return memo[text]
+        except KeyError:
+            pass
+        p = ()
+        for word in self.prefixlookup(text):
+            rest = text[len(word):]
+            pp2 = memo.get(rest)
+            if pp2 is None and len(rest) > 0:
+                pp2 = self._substringcache.peek(rest)
+            if pp2 is None:
+                pp2 = self.segmentlookup(rest, memo)
+            if len(pp2) > 0:
+                pp1 = self.lookup(word)
+                limit = self._maxvariants if self._maxvariants > 0 else len(pp1) * len(pp2)
+                p = set()
+                for p1 in pp1:
+                    for p2 in pp2:
+                        p.add(p1 + p2)
+                        if len(p) >= limit:
+                            break
+                    if len(p) >= limit:
+                        break
+                p = tuple(sorted(p))
+                break
+        memo[text] = p
+        self._substringcache.put(text, p)
+        return p
+
+    #
+    #  known words at the head of the text, longest first
+    #    heads not in the lookup cache are probed at once by knownwords(),
+    #    unknown heads are kept in the cache as words without pronunciation.
+    def prefixlookup(self, text):
+        if self._maxlength is None:
+            self._maxlength = self.maxlength()
+        heads = [text[:i].lower() for i in range(min(len(text), self._maxlength), 0, -1)]
+        known = set()
+        query = []
+        for h in heads:
+            p = self._lookupcache.get(h)
+            if p is None:
+                query.append(h)
+            elif len(p) > 0:
+                known.add(h)
+        if len(query) > 0:
+            found = self.knownwords(query)
+            known.update(found)
+            for h in query:
+                if not h in found:
+                    self._lookupcache.put(h, ())
+        return [h for h in heads if h in known]
+
+    #
+    #  hits and misses of the lookup caches
+    def cachecounts(self):
+        return (self._lookupcache.hits + self._substringcache.hits,
+                self._lookupcache.misses + self._substringcache.misses)
+
+    def stats(self):
+        return { 'lookup': self._lookupcache.stats(), 'substring': self._substringcache.stats(),
+                 'queries': self._queries }
+
+#
+#  Lexicon Database class
+#
+class LexiconDB(Lexicon):
+    ''' Utility class to store pronunciation dictionary to database'''
+    #
+    #  Constructor
+    #
+    def __init__(self, fname, version, prop=None, rebuid=False, cachesize=LOOKUP_CACHE_SIZE,
+                 maxvariants=MAX_VARIANTS):
+        Lexicon.__init__(self, prop, cachesize, maxvariants)
+
         #
         self._db = sqlite3.connect(fname)
         createtable = rebuid
@@ -42,45 +267,67 @@ class LexiconDB:
         #
         #  check version
         if not self.tableexist('version'):
-            # create version table if not
-            self.createversiontable(version)
             createtable = True
             
-        elif len(self._db.execute(u"select text from version where text = '%s';" % (version,)).fetchall()) == 0:
-            # check version
-            self._db.execute(u'drop table version;')
-            self.createversiontable(version)
+        elif len(self._db.execute(u"select text from version where text = ?;", (version,)).fetchall()) == 0:
             createtable = True
 
         #
         # 
         if createtable == True:
-            if self.tableexist('data'):
-                self._db.execute(u'drop table data;')
-            self.createdatatable()
-
-            #
-            #  lexicon of English phrases
-            dic = VoxforgeDict(self._config._julius_dict_en)
-            for (t, vs) in dic._dict.items():
-                for v in vs:
-                    self.register(t.lower(), v, 'ARPAbet')
-            del dic
-
-            #
-            # lexicon of Japanese phrases
-            dic = JuliusDict(self._config._julius_dict_ja)
-            for (t, vs) in dic._dict.items():
-                for v in vs:
-                    self.register(t, v, 'KANA')
-            del dic
+            self.rebuild(version)
+
+    #
+    #  rebuild tables from the dictionaries of Julius
+    #    entries are streamed into executemany() batches in one transaction
+    #    and the indexes are created after loading. the version is written
+    #    in the same transaction, so an interrupted rebuild is done again.
+    #
+    def rebuild(self, version, batchsize=BATCH_SIZE):
+        start = time.time()
+        self._db.execute(u'PRAGMA journal_mode = MEMORY;')
+        self._db.execute(u'PRAGMA synchronous = OFF;')
+        self._db.execute(u'PRAGMA cache_size = -65536;')
+        self._db.execute(u'PRAGMA temp_store = MEMORY;')
+        self._db.execute(u'begin;')
+        try:
+            self._db.execute(u'drop table if exists version;')
+            self._db.execute(u'drop table if exists data;')
+            self._db.execute(u'drop index if exists text_index;')
+            self._db.execute(u'drop index if exists alphabet_index;')
+            self.createversiontable(version)
+            self.createdatatable(False)
 
+            count = 0
+            shown = start
+            batch = []
+            for e in self.entries():
+                batch.append(e)
+                if len(batch) >= batchsize:
+                    count += self.registermany(batch)
+                    batch = []
+                    if time.time() - shown >= 1.0:
+                        shown = time.time()
+                        print ("registering lexicon: %d entries (%.1f sec)" % (count, shown - start))
+            count += self.registermany(batch)
+
+            indexstart = time.time()
+            self.createindexes()
             self._db.commit()
+        except:
+            self._db.rollback()
+            raise
+        finally:
+            self._db.execute(u'PRAGMA synchronous = FULL;')
+            self._db.execute(u'PRAGMA journal_mode = DELETE;')
+        self.clearcache()
+        print ("lexicon database: %d entries, index %.1f sec, total %.1f sec" %
+               (count, time.time() - indexstart, time.time() - start))
 
     #
     # check table exists or not
     def tableexist(self, name):
-        tbls = self._db.execute("select * from sqlite_master where type = 'table' and name = '%s';" % (name,))
+        tbls = self._db.execute("select * from sqlite_master where type = 'table' and name = ?;", (name,))
         return (len(tbls.fetchall()) != 0)
 
     #
@@ -96,7 +343,7 @@ create table version (
 
     #
     #  create lexicon table
-    def createdatatable(self):
+    def createdatatable(self, index=True):
         sql = u"""
 create table data (
   text varchar(10),
@@ -105,6 +352,10 @@ create table data (
 );
 """
         self._db.execute(sql)
+        if index:
+            self.createindexes()
+
+    def createindexes(self):
         self._db.execute('create index text_index on data(text);')
         self._db.execute('create index alphabet_index on data(alphabet);')
 
@@ -114,30 +365,72 @@ create table data (
         sql = u'insert into data values (?,?,?);'
         self._db.execute(sql, (text, pronounce, alphabet))
 
+    def registermany(self, rows):
+        if len(rows) == 0:
+            return 0
+        sql = u'insert into data values (?,?,?);'
+        self._db.executemany(sql, rows)
+        return len(rows)
+
     #
-    #  
-    def lookup(self, text):
-        return list(set([p[0] for p in self._db.execute(u"select pronounce from data where text = '%s';" % (text.lower(),)).fetchall()]))
+    #  pronunciations of the word
+    #    the query is parameterized, so sqlite3 reuses the compiled statement.
+    def query(self, text):
+        return [r[0] for r in self.execute(u"select pronounce from data where text = ?;", (text,))]
 
     #
-    # 
-    def substringlookup(self, text):
-        p = self.lookup(text)
-        if len(p) == 0:
-            for i in range(1, len(text)):
-                substr = text[:-i]
-                reststr = text[len(text)-i:]
-                #print substr + "|" + reststr
-                pp1 = self.lookup(substr)
-                if len(pp1) > 0:
-                    #print substr + ':' + ','.join(pp1)
-                    pp2 = self.substringlookup(reststr)
-                    for p1 in pp1:
-                        for p2 in pp2:
-                            p.append(p1 + p2)
-                    break
-        return list(set(p))
-        
+    #  pronunciations of the words by chunked queries
+    def querymany(self, texts, chunksize=QUERY_CHUNK_SIZE):
+        found = {}
+        for i in range(0, len(texts), chunksize):
+            chunk = texts[i:i + chunksize]
+            sql = u"select text, pronounce from data where text in (%s);" % (u",".join([u"?"] * len(chunk)),)
+            for (t, v) in self.execute(sql, chunk):
+                try:
+                    found[t].append(v)
+                except KeyError:
+                    found[t] = [v,]
+        return found
+
+    #
+    #  words found in the lexicon by one query (on the index only)
+    def knownwords(self, texts):
+        sql = u"select distinct text from data where text in (%s);" % (u",".join([u"?"] * len(texts)),)
+        return set([r[0] for r in self.execute(sql, texts)])
+
+    #
+    #  query on the lexicon (counted in stats)
+    def execute(self, sql, args):
+        self._queries += 1
+        return self._db.execute(sql, args)
+
+    def maxlength(self):
+        return self._db.execute(u"select max(length(text)) from data;").fetchone()[0] or 0
+
+    def keys(self):
+        for r in self._db.execute(u"select distinct text from data;"):
+            yield r[0]
+
+#
+#  open the lexicon of the backend (sqlite or mmap)
+#
+def openlexicon(version, prop=None, rebuild=False, backend=None, **kw):
+    if backend is None and prop :
+        backend = prop.getProperty("julius.lexicon_backend")
+    if backend == 'mmap':
+        from lexiconmap import LexiconMap
+        return LexiconMap(config()._lexiconmap, version, prop, rebuild, **kw)
+    return LexiconDB(config()._lexicondb, version, prop, rebuild, **kw)
+
+#
+#  file of the lexicon of the backend
+#
+def lexiconfile(backend=None):
+    if backend == 'mmap':
+        from lexiconmap import currentfile
+        return currentfile(config()._lexiconmap)
+    return config()._lexicondb
+
 if __name__ == '__main__':
     import sys
     import locale
@@ -0,0 +1,303 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''Read-only memory-mapped pronunciation lexicon
+
+Copyright (C) 2019
+    Isao Hara
+    National Institute of Advanced Industrial Science and Technology (AIST),
+    Japan
+    All rights reserved.
+
+Licensed under the Eclipse Public License -v 1.0 (EPL)
+http://www.opensource.org/licenses/eclipse-1.0.txt
+'''
+
+import sys, os, mmap, struct, tempfile, time, zlib
+import heapq, itertools, shutil
+from array import array
+
+from __init__ import __version__
+from lexicondb import *
+
+#
+#  file format
+#    header : magic, format version, byte order, number of words,
+#             length of the longest word, number of hash slots,
+#             version of the lexicon
+#    offsets: (number of words + 1) unsigned ints, start of each record
+#    slots  : hash table of unsigned ints, index of the word + 1 (0: empty)
+#             at crc32 of the word, collisions go to the next slot
+#    records: utf-8 word, NUL, pronunciations separated by LF
+#             (records are sorted by the utf-8 bytes of the words)
+#
+MAP_MAGIC = b'OHLX'
+MAP_FORMAT = 1
+MAP_HEADER = struct.Struct('<4sHcxIII32s')
+
+#
+#  number of entries sorted in memory at once on build
+#
+SORT_CHUNK_SIZE = 200000
+
+#
+#  generations of the lexicon map: <fname>.<generation>, newest first
+#    a rebuild writes the next generation instead of replacing the file,
+#    because a mapped file can not be replaced on Windows.
+#
+def mapfiles(fname):
+    dirname, base = os.path.split(os.path.abspath(fname))
+    files = []
+    if os.path.isdir(dirname):
+        for f in os.listdir(dirname):
+            gen = f[len(base) + 1:]
+            if f.startswith(base + '.') and gen.isdigit():
+                files.append((int(gen), os.path.join(dirname, f)))
+    files.sort(reverse=True)
+    return files
+
+def currentfile(fname):
+    files = mapfiles(fname)
+    if len(files) == 0:
+        return fname
+    return files[0][1]
+
+#
+#  remove generations older than the mapped one and the unnumbered file
+#    removing a file mapped by another process fails on Windows, such
+#    files are left and removed by a later call.
+#
+def removeold(fname, current):
+    files = [f for (gen, f) in mapfiles(fname)]
+    if current in files:
+        files = files[files.index(current) + 1:]
+    for f in files + [fname]:
+        if f == current or not os.path.exists(f):
+            continue
+        try:
+            os.remove(f)
+        except OSError:
+            pass
+
+#
+#  utf-8 lines 'word NUL pronunciation' of the entries sorted in chunks
+#  and merged (only one chunk is kept in memory)
+#
+def sortedentries(entries, chunksize=SORT_CHUNK_SIZE):
+    runs = []
+    while True:
+        chunk = [(t + u'\0' + v).encode('utf-8') for (t, v, alphabet) in itertools.islice(entries, chunksize)]
+        if len(chunk) == 0:
+            break
+        chunk.sort()
+        f = tempfile.TemporaryFile()
+        for l in chunk:
+            f.write(l + b'\n')
+        f.seek(0)
+        runs.append(f)
+        del chunk
+    try:
+        prev = None
+        for l in heapq.merge(*[(l[:-1] for l in f) for f in runs]):
+            if l != prev:
+                yield l
+                prev = l
+    finally:
+        for f in runs:
+            f.close()
+
+#
+#  Memory-mapped lexicon class
+#    words are found by the hash table in the mapped file. the pages are
+#    shared by all processes mapping the same file.
+#
+class LexiconMap(Lexicon):
+    ''' Utility class to look up pronunciations in a memory-mapped file'''
+    #
+    #  Constructor
+    #
+    def __init__(self, fname, version, prop=None, rebuid=False, cachesize=LOOKUP_CACHE_SIZE,
+                 maxvariants=MAX_VARIANTS):
+        Lexicon.__init__(self, prop, cachesize, maxvariants)
+        self._fname = fname
+        self._path = None
+        self._file = None
+        self._map = None
+        self._mv = None
+        if rebuid or not self.open(version):
+            self.build(version)
+            if not self.open(version):
+                raise IOError("invalid lexicon map: %s" % (fname,))
+
+    def __del__(self):
+        self.close()
+
+    #
+    #  map the newest generation of the file (False if missing or outdated)
+    #    older generations left by a previous build are removed.
+    #
+    def open(self, version):
+        self.close()
+        self._path = currentfile(self._fname)
+        try:
+            self._file = open(self._path, 'rb')
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (IOError, OSError, ValueError):
+            self.close()
+            return False
+        if len(self._map) < MAP_HEADER.size:
+            self.close()
+            return False
+        (magic, fmt, order, count, maxlength, nslots, ver) = MAP_HEADER.unpack_from(self._map, 0)
+        byteorder = b'<' if sys.byteorder == 'little' else b'>'
+        if (magic != MAP_MAGIC or fmt != MAP_FORMAT or order != byteorder or
+            ver.rstrip(b'\0').decode('utf-8') != version):
+            self.close()
+            return False
+        self._count = count
+        self._maxwordlength = maxlength
+        self._mask = nslots - 1
+        self._mv = memoryview(self._map)
+        start = MAP_HEADER.size
+        self._offsets = self._mv[start:start + 4 * (count + 1)].cast('I')
+        start += 4 * (count + 1)
+        self._slots = self._mv[start:start + 4 * nslots].cast('I')
+        removeold(self._fname, self._path)
+        return True
+
+    #
+    #  unmap the file (also called from __del__ after a failed __init__)
+    #
+    def close(self):
+        for v in ('_offsets', '_slots', '_mv'):
+            if getattr(self, v, None) is not None:
+                getattr(self, v).release()
+                setattr(self, v, None)
+        for v in ('_map', '_file'):
+            if getattr(self, v, None) is not None:
+                getattr(self, v).close()
+                setattr(self, v, None)
+
+    #
+    #  build the next generation of the file from the dictionaries of Julius
+    #    records are written from the merged stream of sorted entries, only
+    #    offsets and hashes of the words are kept in memory. processes
+    #    mapping older generations are not disturbed, the old files are
+    #    removed when they are no longer mapped.
+    #
+    def build(self, version):
+        start = time.time()
+        dirname = os.path.dirname(os.path.abspath(self._fname))
+        offsets = array('I')
+        hashes = array('I')
+        maxlength = 0
+        pos = 0
+        with tempfile.TemporaryFile(dir=dirname) as records:
+            for (kb, lines) in itertools.groupby(sortedentries(self.entries()), lambda l: l[:l.index(b'\0')]):
+                rec = kb + b'\0' + b'\n'.join([l[len(kb) + 1:] for l in lines])
+                offsets.append(pos)
+                hashes.append(zlib.crc32(kb) & 0xffffffff)
+                maxlength = max(maxlength, len(kb.decode('utf-8')))
+                records.write(rec)
+                pos += len(rec)
+            offsets.append(pos)
+            count = len(hashes)
+
+            nslots = 1
+            while nslots < count * 2:
+                nslots *= 2
+            slots = array('I', [0]) * nslots
+            for (i, h) in enumerate(hashes):
+                h &= nslots - 1
+                while slots[h] != 0:
+                    h = (h + 1) & (nslots - 1)
+                slots[h] = i + 1
+            base = MAP_HEADER.size + 4 * (count + 1) + 4 * nslots
+            offsets = array('I', [o + base for o in offsets])
+            byteorder = b'<' if sys.byteorder == 'little' else b'>'
+            header = MAP_HEADER.pack(MAP_MAGIC, MAP_FORMAT, byteorder, count, maxlength, nslots,
+                                     version.encode('utf-8'))
+
+            self.close()
+            files = mapfiles(self._fname)
+            path = "%s.%d" % (os.path.abspath(self._fname), (files[0][0] + 1 if files else 1))
+            fd, tmpname = tempfile.mkstemp(dir=dirname)
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(header)
+                    f.write(offsets.tobytes())
+                    f.write(slots.tobytes())
+                    records.seek(0)
+                    shutil.copyfileobj(records, f)
+                os.replace(tmpname, path)
+            except OSError:
+                os.remove(tmpname)
+                if not os.path.exists(path):
+                    raise
+                print ("lexicon map: %s was built by another process" % (path,))
+        removeold(self._fname, path)
+        self.clearcache()
+        print ("lexicon map: %d words, %d bytes, %.1f sec" % (count, base + pos, time.time() - start))
+
+    #
+    #  start and end of the utf-8 bytes of the i-th word
+    #
+    def keyrange(self, i):
+        start = self._offsets[i]
+        return (start, self._map.find(b'\0', start, self._offsets[i + 1]))
+
+    #
+    #  utf-8 bytes of the i-th word (a view of the mapped file, not copied)
+    #
+    def key(self, i):
+        (start, end) = self.keyrange(i)
+        return self._mv[start:end]
+
+    #
+    #  index of the word (-1 if not found)
+    #
+    def find(self, text):
+        k = text.encode('utf-8')
+        h = zlib.crc32(k) & self._mask
+        while True:
+            i = self._slots[h]
+            if i == 0:
+                return -1
+            (start, end) = self.keyrange(i - 1)
+            if end - start == len(k) and self._mv[start:end] == k:
+                return i - 1
+            h = (h + 1) & self._mask
+
+    #
+    #  pronunciations of the word
+    #
+    def query(self, text):
+        i = self.find(text)
+        if i < 0:
+            return []
+        start = self._offsets[i]
+        end = self._offsets[i + 1]
+        return str(self._mv[self._map.find(b'\0', start, end) + 1:end], 'utf-8').split(u'\n')
+
+    def querymany(self, texts):
+        found = {}
+        for t in texts:
+            p = self.query(t)
+            if len(p) > 0:
+                found[t] = p
+        return found
+
+    def knownwords(self, texts):
+        return set([t for t in texts if self.find(t) >= 0])
+
+    def maxlength(self):
+        return self._maxwordlength
+
+    def keys(self):
+        for i in range(self._count):
+            yield str(self.key(i), 'utf-8')
+
+if __name__ == '__main__':
+    lex = openlexicon(__version__, backend='mmap')
+    for w in sys.argv[1:]:
+        print ("%s: %s" % (w, ','.join(lex.lookup(w) or lex.substringlookup(w))))
@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''Event loop for Julius module sockets
+
+Copyright (C) 2019
+    Isao Hara
+    National Institute of Advanced Industrial Science and Technology (AIST),
+    Japan
+    All rights reserved.
+
+Licensed under the Eclipse Public License -v 1.0 (EPL)
+http://www.opensource.org/licenses/eclipse-1.0.txt
+'''
+
+import sys, os, socket, threading, selectors
+import time, traceback
+import collections
+
+#
+#  Counters for each registered socket
+#    latency  : time from reading the data to starting its dispatch
+#    callback : time spent in the dispatch callback
+#
+class LoopStats:
+    def __init__(self):
+        self.events = 0
+        self.bytes = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.total_callback = 0.0
+        self.max_callback = 0.0
+        self.depth = 0
+        self.max_depth = 0
+
+    def add(self, size, latency, callback):
+        self.events += 1
+        self.bytes += size
+        self.total_latency += latency
+        if latency > self.max_latency:
+            self.max_latency = latency
+        self.total_callback += callback
+        if callback > self.max_callback:
+            self.max_callback = callback
+
+    def average(self, total):
+        if self.events == 0:
+            return 0.0
+        return total / self.events
+
+    def todict(self):
+        return { 'events': self.events, 'bytes': self.bytes,
+                 'avg_latency': self.average(self.total_latency), 'max_latency': self.max_latency,
+                 'avg_callback': self.average(self.total_callback), 'max_callback': self.max_callback,
+                 'depth': self.depth, 'max_depth': self.max_depth }
+
+#
+#  Dispatch thread of a registered socket
+#    results of ondata are queued by the loop thread and passed to
+#    ondispatch in this thread, so a slow callback blocks only its own socket.
+#
+class SocketDispatcher(threading.Thread):
+    def __init__(self, ondispatch, onclose, stats):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self._ondispatch = ondispatch
+        self._onclose = onclose
+        self._stats = stats
+        self._queue = collections.deque()
+        self._cond = threading.Condition()
+        self._running = True
+        self._closed = False
+
+    #
+    #  put the result of ondata (called from the loop thread)
+    #
+    def put(self, arrival, size, items):
+        with self._cond:
+            self._queue.append((arrival, size, items))
+            self._stats.depth = len(self._queue)
+            if self._stats.depth > self._stats.max_depth:
+                self._stats.max_depth = self._stats.depth
+            self._cond.notify_all()
+
+    #
+    #  stop after the queued items, onclose is called if closed by peer
+    #
+    def stop(self, closed=False):
+        with self._cond:
+            self._running = False
+            self._closed = closed
+            self._cond.notify_all()
+
+    #
+    #  Run
+    #
+    def run(self):
+        while True:
+            with self._cond:
+                while self._running and len(self._queue) == 0:
+                    self._cond.wait()
+                if len(self._queue) == 0:
+                    break
+                (arrival, size, items) = self._queue.popleft()
+                self._stats.depth = len(self._queue)
+            start = time.time()
+            if items and self._ondispatch:
+                try:
+                    self._ondispatch(items)
+                except:
+                    traceback.print_exc()
+            self._stats.add(size, start - arrival, time.time() - start)
+        if self._closed and self._onclose:
+            try:
+                self._onclose()
+            except:
+                traceback.print_exc()
+
+#
+#  Event loop multiplexing module sockets of all JuliusWrap in a process
+#    the loop thread only reads and parses the data, callbacks run in
+#    the dispatch thread of each socket.
+#
+class ModuleSocketLoop(threading.Thread):
+    #
+    #  Constructor
+    #
+    def __init__(self, bufsize=1024*10):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self._bufsize = bufsize
+        self._selector = selectors.DefaultSelector()
+        self._lock = threading.Lock()
+        self._waker_r, self._waker_w = socket.socketpair()
+        self._waker_r.setblocking(False)
+        self._selector.register(self._waker_r, selectors.EVENT_READ, None)
+        self._pending = []
+        self._stats = {}
+        self._running = True
+
+    #
+    #  Register socket
+    #    ondata(bytes) is called in the loop thread when data arrives and
+    #    returns a list of items, ondispatch(items) and onclose() (when
+    #    the peer closed the socket) are called in the dispatch thread.
+    #
+    def register(self, sock, ondata, ondispatch=None, onclose=None):
+        stats = LoopStats()
+        dispatcher = SocketDispatcher(ondispatch, onclose, stats)
+        dispatcher.start()
+        with self._lock:
+            self._pending.append(('register', sock, (ondata, dispatcher)))
+            self._stats[sock] = stats
+        self.wakeup()
+
+    #
+    #  Unregister socket
+    #
+    def unregister(self, sock):
+        done = threading.Event()
+        with self._lock:
+            self._pending.append(('unregister', sock, done))
+        self.wakeup()
+        if threading.current_thread() is not self:
+            done.wait(1.0)
+
+    #
+    #  Counters of the socket
+    #
+    def stats(self, sock):
+        try:
+            return self._stats[sock].todict()
+        except KeyError:
+            return LoopStats().todict()
+
+    #
+    #
+    def wakeup(self):
+        try:
+            self._waker_w.send(b'\0')
+        except socket.error:
+            pass
+
+    #
+    #  apply register/unregister requests (called in the loop thread)
+    #
+    def update(self):
+        with self._lock:
+            pending = self._pending
+            self._pending = []
+        for (cmd, sock, arg) in pending:
+            if cmd == 'register':
+                try:
+                    self._selector.register(sock, selectors.EVENT_READ, arg)
+                except (KeyError, ValueError):
+                    traceback.print_exc()
+                    arg[1].stop()
+            else:
+                try:
+                    key = self._selector.unregister(sock)
+                    key.data[1].stop()
+                except (KeyError, ValueError):
+                    pass
+                self._stats.pop(sock, None)
+                arg.set()
+
+    #
+    #  close socket by peer
+    #
+    def close(self, key):
+        try:
+            self._selector.unregister(key.fileobj)
+        except (KeyError, ValueError):
+            pass
+        ondata, dispatcher = key.data
+        dispatcher.stop(True)
+
+    #
+    #  Run
+    #
+    def run(self):
+        while self._running:
+            events = self._selector.select()
+            for key, mask in events:
+                if key.data is None:
+                    try:
+                        while self._waker_r.recv(1024):
+                            pass
+                    except socket.error:
+                        pass
+                    continue
+                try:
+                    data = key.fileobj.recv(self._bufsize)
+                except socket.error:
+                    print ('socket error')
+                    self.close(key)
+                    continue
+                if not data:
+                    self.close(key)
+                    continue
+                arrival = time.time()
+                ondata, dispatcher = key.data
+                items = None
+                try:
+                    items = ondata(data)
+                except:
+                    traceback.print_exc()
+                dispatcher.put(arrival, len(data), items)
+            self.update()
+
+#
+#  Shared loop
+#
+_loop = None
+_loop_lock = threading.Lock()
+
+def getloop():
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = ModuleSocketLoop()
+            _loop.start()
+        return _loop
@@ -37,21 +37,11 @@ class JuliusDict:
     #
     #  parse dict file 
     def parse(self, fname):
-        f = open(fname, 'r', encoding='utf-8')
-        kcode='euc-jp'
-        for l in f:
-            matchObj = re.search(r'\[.+\]', l)
-            if matchObj :
-                t = conv_encoding(matchObj.group())
-                t = t[1:-1]
-                #print (t)
-                ph = conv_encoding(l).rsplit(']')
-                if len(ph) > 1:
-                    st = [ ' '+ph[1].strip() ]
-                    try:
-                        self._dict[t].extend(st)
-                    except KeyError:
-                        self._dict[t] = st
+        for (t, st) in juliusdict_entries(fname):
+            try:
+                self._dict[t].append(st)
+            except KeyError:
+                self._dict[t] = [st,]
     #
     #  lookup 
     def lookup(self, w):
@@ -60,6 +50,20 @@ class JuliusDict:
         except KeyError:
             return []
 #
+#  Stream (word, pronunciation) entries of the dictionary file
+#
+def juliusdict_entries(fname):
+    with open(fname, 'r', encoding='utf-8') as f:
+        for l in f:
+            matchObj = re.search(r'\[.+\]', l)
+            if matchObj :
+                t = conv_encoding(matchObj.group())
+                t = t[1:-1]
+                ph = conv_encoding(l).rsplit(']')
+                if len(ph) > 1:
+                    yield (t, ' '+ph[1].strip())
+
+#
 #  Convert utf-8 or euc-jp to Unicode
 #
 def conv_encoding(data):
@@ -13,7 +13,9 @@ Licensed under the Eclipse Public License -v 1.0 (EPL)
 http://www.opensource.org/licenses/eclipse-1.0.txt
 '''
 
-import sys, os, re, codecs, types
+import sys, os, re, codecs, types, time
+import json, hashlib, tempfile
+from array import array
 from lxml import etree
 
 from io import StringIO
@@ -22,6 +24,27 @@ from __init__ import __version__
 from config import config
 from lexicondb import *
 
+#
+#  version of the SRGS to Julius converter (used as a part of grammar cache key)
+#
+COMPILER_VERSION = "5"
+
+#
+#  one-of blocks with at least this number of plain text items are
+#  compiled into a prefix trie
+#
+TRIE_THRESHOLD = 32
+
+#
+#  max of open repeat (repeat="m-")
+#
+UNBOUNDED = -1
+
+#
+#  version of the on-disk format of parsed PLS lexicons
+#
+PLS_CACHE_VERSION = 1
+
 #
 #
 #
@@ -31,6 +54,13 @@ def isempty(node):
             return True
     return False
 
+#
+#  <item>word word ...</item> without repeat
+#
+def isplaintext(item):
+    return (item._type == "item" and item._repeatmin is None and item._repeatmax is None
+            and len(item._items) == 1 and item._items[0]._type == "#text")
+
 #
 #
 #
@@ -38,101 +68,179 @@ class nulltransform:
     def convert(self, text):
         return text
 
+#
+#  parsed PLS lexicons shared in the process: path -> (stamp, dict, alphabet)
+#
+_pls_memory = {}
+
 #
 #
 #
 class PLS:
     """ Utility class to parse W3C Pronunciation Lexicon Specification."""
     #
+    #  usecache: reuse parsed lexicons (in memory and in ~/.openhri/pls_cache)
     #
-    def __init__(self):
+    def __init__(self, usecache=True):
         self._dict = {}
         self._alphabet = {}
+        self._usecache = usecache
 
     #
     #
     def parse(self, files):
+        for f in files:
+            try:
+                (d, alphabet) = self.load(f)
+            except etree.XMLSyntaxError as e:
+                print ("[error] invalid xml syntax")
+                print (e)
+                continue
+            except (IOError, OSError) as e:
+                print ("[error] IO error: unable to open file ", f)
+                print (e)
+                continue
+            # lists of the cached lexicon are shared, not modified
+            if len(self._dict) == 0:
+                self._dict = dict(d)
+            else:
+                for (g, ps) in d.items():
+                    if g in self._dict:
+                        self._dict[g] = self._dict[g] + ps
+                    else:
+                        self._dict[g] = ps
+            self._alphabet.update(alphabet)
+        return self
+
+    #
+    #  parsed lexicon of the file: from memory, disk cache or the file
+    #
+    def load(self, f):
+        if not self._usecache:
+            return self.parsefile(f)
+        st = os.stat(f)
+        stamp = [PLS_CACHE_VERSION, st.st_mtime, st.st_size]
+        path = os.path.abspath(f)
+        try:
+            (s, d, alphabet) = _pls_memory[path]
+            if s == stamp:
+                return (d, alphabet)
+        except KeyError:
+            pass
+
+        cachefile = os.path.join(config()._configdir, 'pls_cache',
+                                 hashlib.sha1(path.encode('utf-8')).hexdigest() + '.json')
+        try:
+            with open(cachefile, 'r', encoding='utf-8') as fp:
+                data = json.load(fp)
+            if data['path'] == path and data['stamp'] == stamp:
+                _pls_memory[path] = (stamp, data['dict'], data['alphabet'])
+                return (data['dict'], data['alphabet'])
+        except (IOError, OSError, ValueError, KeyError):
+            pass
+
+        (d, alphabet) = self.parsefile(f)
+        _pls_memory[path] = (stamp, d, alphabet)
+        try:
+            if not os.path.exists(os.path.dirname(cachefile)):
+                os.makedirs(os.path.dirname(cachefile))
+            fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(cachefile))
+            with os.fdopen(fd, 'w', encoding='utf-8') as fp:
+                json.dump({'path': path, 'stamp': stamp, 'dict': d, 'alphabet': alphabet},
+                          fp, ensure_ascii=False, separators=(',', ':'))
+            os.replace(tmpname, cachefile)
+        except (IOError, OSError) as e:
+            print ("[warning] unable to write lexicon cache: ", cachefile)
+            print (e)
+        return (d, alphabet)
+
+    #
+    #  parse one PLS file, elements are released while parsing
+    #
+    def parsefile(self, f):
+        d = {}
+        alphabet = {}
         grapheme = []
         phoneme = []
         ipa = ''
         sampa = ''
-        try:
-            for f in files:
-                for event, elem in etree.iterparse(f):
-                    if elem.tag.find("lexeme") >= 0:
-                        for g in grapheme:
-                            for p in phoneme:
-                                try:
-                                    (ptype, pval) = p.strip('{}').split('|')
-                                except ValueError:
-                                    ptype = 'ipa'
-                                    pval = p
-                                try:
-                                    self._dict[g].append(pval)
-                                except KeyError:
-                                    self._dict[g] = [pval,]
-                        grapheme = []
-                        phoneme = []
-                    elif elem.tag.find("grapheme") >= 0:
-                        grapheme.append(elem.text)
-                    elif elem.tag.find("phoneme") >= 0:
-                        phoneme.append(elem.text)
-                    elif elem.tag.find("alphabet") >= 0:
-                        self._alphabet[ipa] = sampa
-                        ipa = ''
-                        sampa = ''
-                    elif elem.tag.find("ipa") >= 0:
-                        ipa = elem.text
-                    elif elem.tag.find("sampa") >= 0:
-                        sampa = elem.text
-        except etree.XMLSyntaxError as e:
-            print ("[error] invalid xml syntax")
-            print (e)
-        except IOError as e:
-            print ("[error] IO error: unable to open file ", file)
-            print (e)
-        return self
+        for event, elem in etree.iterparse(f):
+            if elem.tag.find("lexeme") >= 0:
+                for g in grapheme:
+                    for p in phoneme:
+                        try:
+                            (ptype, pval) = p.strip('{}').split('|')
+                        except ValueError:
+                            ptype = 'ipa'
+                            pval = p
+                        try:
+                            d[g].append(pval)
+                        except KeyError:
+                            d[g] = [pval,]
+                grapheme = []
+                phoneme = []
+                elem.clear()
+                while elem.getprevious() is not None:
+                    del elem.getparent()[0]
+            elif elem.tag.find("grapheme") >= 0:
+                grapheme.append(elem.text)
+            elif elem.tag.find("phoneme") >= 0:
+                phoneme.append(elem.text)
+            elif elem.tag.find("alphabet") >= 0:
+                alphabet[ipa] = sampa
+                ipa = ''
+                sampa = ''
+                elem.clear()
+            elif elem.tag.find("ipa") >= 0:
+                ipa = elem.text
+            elif elem.tag.find("sampa") >= 0:
+                sampa = elem.text
+        return (d, alphabet)
 
 #
 #
 #
 class SRGSItem:
+    __slots__ = ('_type', '_items', '_repeatmin', '_repeatmax', '_words', '_uri', '_tag')
     #
     #
     def __init__(self):
         self._type = None
         self._items = None
+        self._repeatmin = None
+        self._repeatmax = None
+        self._words = None
+        self._uri = None
+        self._tag = None
 
     #
     #
     def parse(self, node):
-        self._type = node.tag.replace('{http://www.w3.org/2001/06/grammar}', '')
+        self._type = sys.intern(node.tag.replace('{http://www.w3.org/2001/06/grammar}', ''))
         if self._type == "item":
             self._repeatmin = None
             self._repeatmax = None
-            try:
-                repeat = node.attrib['repeat']
-                if repeat:
-                    rp = repeat.split('-')
-                    if rp[0]:
-                        self._repeatmin = int(rp[0])
-                    if rp[1]:
-                        self._repeatmax = int(rp[1])
-            except KeyError:
-                pass
+            repeat = node.get('repeat')
+            if repeat:
+                rp = repeat.strip().split('-')
+                if len(rp) == 1:
+                    self._repeatmin = self._repeatmax = int(rp[0])
+                else:
+                    self._repeatmin = int(rp[0]) if rp[0] else 0
+                    self._repeatmax = int(rp[1]) if rp[1] else UNBOUNDED
             children = node.getchildren()
             if len(children) > 0:
-                self._items = [SRGSItem().parse(c) for c in node.getchildren() if type(c) is not etree._Comment]
+                self._items = tuple([SRGSItem().parse(c) for c in node.getchildren() if type(c) is not etree._Comment])
             else:
                 textnode = SRGSItem()
                 textnode._type = "#text"
                 if type(node.text) is type(None):
-                    textnode._words = []
+                    textnode._words = ()
                 else:
-                    textnode._words = [w for w in re.split(u"( |[\\\"'].*[\\\"'])", node.text.strip(' \n')) if w != '' and w != u' ']
-                self._items = [textnode,]
+                    textnode._words = tuple([sys.intern(w) for w in re.split(u"( |[\\\"'].*[\\\"'])", node.text.strip(' \n')) if w != '' and w != u' '])
+                self._items = (textnode,)
         elif self._type == "one-of":
-            self._items = [SRGSItem().parse(c) for c in node.getchildren() if type(c) is not etree._Comment]
+            self._items = tuple([SRGSItem().parse(c) for c in node.getchildren() if type(c) is not etree._Comment])
         elif self._type == "ruleref":
             self._uri = node.get('uri')
         elif self._type == "tag":
@@ -143,6 +251,7 @@ class SRGSItem:
 #
 #
 class SRGSRule:
+    __slots__ = ('_id', '_items')
     #
     #
     def __init__(self):
@@ -152,7 +261,7 @@ class SRGSRule:
     #
     def parse(self, node):
         self._id = node.get('id')
-        self._items = [SRGSItem().parse(c) for c in node.getchildren() if type(c) is not etree._Comment]
+        self._items = tuple([SRGSItem().parse(c) for c in node.getchildren() if type(c) is not etree._Comment])
         return self
 
 #
@@ -161,9 +270,9 @@ class SRGSRule:
 class SRGS:
     """ Utility class to parse W3C Speech Recognition Grammar Specification."""
     #
+    #  backend: lexicon backend (sqlite or mmap, default: julius.lexicon_backend of prop)
     #
-    #
-    def __init__(self, file, prop=None, rebuild_lexicon=False):
+    def __init__(self, file, prop=None, rebuild_lexicon=False, cache=None, backend=None):
         self._config = config()
         self._filename = file
         self._rules = {}
@@ -172,24 +281,66 @@ class SRGS:
         self._lex = None
         self._node = None
         self._rebuild_lexicon=rebuild_lexicon
+        self._cache = cache
+        self._cachekey = None
+        self._compilestats = {}
+        self._compiletimes = {}
+        self._phasetimes = {}
+        self._lexstats = { 'pls_hits': 0, 'db_hits': 0, 'misses': 0, 'cache_hits': 0, 'cache_misses': 0 }
+        self._fragments = {}
+        self._compiling = set()
 
         self._prop = prop
+        self._backend = backend
         if prop :
             if prop.getProperty("julius.3rdparty_dir") :
                 self._config.julius(prop.getProperty("julius.3rdparty_dir"))
+            if backend is None :
+                self._backend = prop.getProperty("julius.lexicon_backend") or None
+
+        self.load()
 
+    #
+    #  read the grammar file
+    #
+    def load(self):
         try:
-            doc = etree.parse(file)
+            start = time.time()
+            doc = etree.parse(self._filename)
+            self.phasetime('xml', start)
+            start = time.time()
             doc.xinclude()
+            self.phasetime('xinclude', start)
             self._node = doc.getroot()
 
         except etree.XMLSyntaxError as e:
             print ("[error] invalid xml syntax")
             print (e)
         except IOError as e:
-            print ("[error] IO error: unable to open file ", file)
+            print ("[error] IO error: unable to open file ", self._filename)
             print (e)
+        start = time.time()
         self.parse(self._node)
+        self.phasetime('tree', start)
+
+    #
+    #  accumulate elapsed time of the compile phase
+    #    xml, xinclude, tree, lexicon, build, minimize, output
+    #
+    def phasetime(self, phase, start):
+        self._phasetimes[phase] = self._phasetimes.get(phase, 0.0) + time.time() - start
+
+    #
+    #  release the parse tree and compiled fragments after compilation
+    #    the grammar file is read again if a rule has to be compiled later.
+    #
+    def droptree(self):
+        if isinstance(self._filename, StringIO):
+            return
+        self._node = None
+        self._fragments = {}
+        for r in self._rules.values():
+            r._items = None
 
     #
     #
@@ -205,6 +356,108 @@ class SRGS:
             self._rules[rr._id] = rr
         self._rootrule = node.get('root')
 
+    #
+    #  files of the grammar: grammar file, XIncluded parts and lexicons
+    #
+    def dependencies(self):
+        if isinstance(self._filename, StringIO):
+            return []
+        files = []
+        self.xincludes(self._filename, files)
+        if self._lex is not None:
+            files.extend(self._lex)
+        return files
+
+    def xincludes(self, fname, files):
+        if fname in files:
+            return
+        files.append(fname)
+        try:
+            doc = etree.parse(fname)
+        except (etree.XMLSyntaxError, IOError):
+            return
+        for n in doc.iter('{http://www.w3.org/2001/XInclude}include'):
+            href = n.get('href')
+            if href:
+                self.xincludes(os.path.join(os.path.dirname(fname), href), files)
+
+    #
+    #  key of the grammar cache
+    #
+    def cachekey(self):
+        if self._cachekey is None:
+            files = self.dependencies()
+            if len(files) == 0:
+                return None
+            lexdb = lexiconfile(self._backend)
+            if os.path.exists(lexdb):
+                lexstat = os.stat(lexdb)
+                lexdb = "%s:%d:%d" % (lexdb, lexstat.st_size, lexstat.st_mtime)
+            versions = (COMPILER_VERSION, __version__, lexdb, maxvariants_of(self._prop),
+                        getattr(self._config, "_julius_dict_en", None), getattr(self._config, "_julius_dict_ja", None))
+            try:
+                self._cachekey = self._cache.key(files, versions)
+            except (IOError, OSError):
+                return None
+        return self._cachekey
+
+    #
+    #  fingerprints of the dependency closure of rules {rule: sha1}
+    #    a fingerprint covers the items of the rule and of the rules it
+    #    refers to, and the pronunciations of its words in the lexicons.
+    #    rules with the same fingerprint compile into the same grammar.
+    #
+    def fingerprints(self, lex=None):
+        for r in self._rules.values():
+            if r._items is None:
+                self.load()
+                break
+        if lex is None and self._lex is not None:
+            lex = PLS().parse(self._lex)
+        lexdb = lexiconfile(self._backend)
+        if os.path.exists(lexdb):
+            lexstat = os.stat(lexdb)
+            lexdb = "%s:%d:%d" % (lexdb, lexstat.st_size, lexstat.st_mtime)
+        memo = {}
+        for r in self._rules.keys():
+            self.fingerprint(r, lex, lexdb, memo)
+        return memo
+
+    def fingerprint(self, ruleid, lex, lexdb, memo):
+        try:
+            return memo[ruleid]
+        except KeyError:
+            pass
+        if not ruleid in self._rules:
+            return "unknown:%s" % (ruleid,)
+        memo[ruleid] = "recursive:%s" % (ruleid,)
+        refs = set()
+        words = set()
+        sig = tuple([self.signature(i, refs, words) for i in self._rules[ruleid]._items])
+        h = hashlib.sha1(repr((COMPILER_VERSION, lexdb, self._lang, sig)).encode('utf-8'))
+        for w in sorted(words):
+            p = None
+            if lex is not None:
+                p = lex._dict.get(w)
+            h.update(repr((w, p)).encode('utf-8'))
+        for r in sorted(refs):
+            h.update(self.fingerprint(r, lex, lexdb, memo).encode('utf-8'))
+        memo[ruleid] = h.hexdigest()
+        return memo[ruleid]
+
+    def signature(self, item, refs, words):
+        if item._type == "#text":
+            words.update(item._words)
+            return item._words
+        elif item._type == "ruleref":
+            if item._uri and item._uri[0] == '#':
+                refs.add(item._uri[1:])
+            return ("ruleref", item._uri)
+        elif item._type == "tag":
+            return ("tag",)
+        items = tuple([self.signature(i, refs, words) for i in item._items or ()])
+        return (item._type, item._repeatmin, item._repeatmax, items)
+
     #
     #
     #
@@ -247,95 +500,234 @@ class SRGS:
             dfa.append((currentstate, item._words[-1], endstate))
 
         elif item._type == "item":
-            if item._repeatmax:
-                currentstate = startstate
-                if item._repeatmax == 1:
-                    for i in item._items[:-1]:
-                        newstate = dfa.newstate()
-                        self.toJulius_recur(i, dfa, currentstate, newstate)
-                        currentstate = newstate
-                    self.toJulius_recur(item._items[-1], dfa, currentstate, endstate)
-                else:
-                    for l in range(0, item._repeatmax - 1):
-                        newstate = dfa.newstate()
-                        currentstate2 = currentstate
-                        for i in item._items[:-1]:
-                            newstate2 = dfa.newstate()
-                            self.toJulius_recur(i, dfa, currentstate2, newstate2)
-                            currentstate2 = newstate2
-                        self.toJulius_recur(item._items[-1], dfa, currentstate, newstate)
-                        for v in dfa._dfa:
-                            if v[2] == currentstate:
-                                dfa.append((v[0], v[1], endstate))
-                        currentstate = newstate
-                    currentstate2 = currentstate
-                    for i in item._items[:-1]:
-                        newstate2 = dfa.newstate()
-                        self.toJulius_recur(i, dfa, currentstate2, newstate2)
-                        currentstate2 = newstate2
-                    self.toJulius_recur(item._items[-1], dfa, currentstate, endstate)
-                    for v in dfa._dfa:
-                        if v[2] == currentstate:
-                            dfa.append((v[0], v[1], endstate))
+            if item._repeatmin is None:
+                self.toJulius_seq(item._items, dfa, startstate, endstate)
+                return
+            repeatmin = item._repeatmin
+            repeatmax = item._repeatmax
+            if repeatmax != UNBOUNDED and repeatmax < repeatmin:
+                raise KeyError("invalid repeat: %d-%d" % (repeatmin, repeatmax))
+            if repeatmax == 0:
+                dfa.append((startstate, dfa.EPSILON, endstate))
+                return
+
+            # mandatory copies
+            currentstate = startstate
+            ncopies = repeatmin
+            if repeatmax != UNBOUNDED and repeatmin == repeatmax:
+                ncopies -= 1
+            for l in range(ncopies):
+                newstate = dfa.newstate()
+                self.toJulius_seq(item._items, dfa, currentstate, newstate)
+                currentstate = newstate
+
+            if repeatmax == UNBOUNDED:
+                # loop on a state of its own
+                if currentstate == startstate:
+                    newstate = dfa.newstate()
+                    dfa.append((startstate, dfa.EPSILON, newstate))
+                    currentstate = newstate
+                self.toJulius_seq(item._items, dfa, currentstate, currentstate)
+                dfa.append((currentstate, dfa.EPSILON, endstate))
+            elif repeatmin == repeatmax:
+                self.toJulius_seq(item._items, dfa, currentstate, endstate)
             else:
-                currentstate = startstate
-                for i in item._items[:-1]:
+                # optional copies can exit to endstate
+                for l in range(repeatmax - repeatmin - 1):
                     newstate = dfa.newstate()
-                    self.toJulius_recur(i, dfa, currentstate, newstate)
+                    dfa.append((currentstate, dfa.EPSILON, endstate))
+                    self.toJulius_seq(item._items, dfa, currentstate, newstate)
                     currentstate = newstate
-                self.toJulius_recur(item._items[-1], dfa, currentstate, endstate)
-            if item._repeatmin == 0: # add skip transition
-                for v in dfa._dfa:
-                    if v[2] == startstate:
-                        dfa.append((v[0], v[1], endstate))
+                dfa.append((currentstate, dfa.EPSILON, endstate))
+                self.toJulius_seq(item._items, dfa, currentstate, endstate)
 
         elif item._type == "one-of":
+            plain = [i for i in item._items if isplaintext(i)]
+            if len(plain) < TRIE_THRESHOLD:
+                plain = []
+            if len(plain) > 0:
+                self.toJulius_trie(plain, dfa, startstate, endstate)
             for i in item._items:
-                self.toJulius_recur(i, dfa, startstate, endstate)
+                if len(plain) == 0 or not isplaintext(i):
+                    self.toJulius_recur(i, dfa, startstate, endstate)
 
         elif item._type == "ruleref":
             if item._uri[0] != '#':
                 raise KeyError("reference to external uri: %s" % (item._uri,))
-            try:
-                root = self._rules[item._uri[1:]]
-            except KeyError:
-                raise KeyError("unknown rule: %s" % (item._uri,))
-            currentstate = startstate
-            for i in root._items[:-1]:
-                newstate = dfa.newstate()
-                self.toJulius_recur(i, dfa, currentstate, newstate)
-                currentstate = newstate
-            self.toJulius_recur(root._items[-1], dfa, currentstate, endstate)
+            dfa.splice(self.fragment(item._uri[1:]), startstate, endstate)
 
         elif item._type == "tag":
             pass
 
+    #
+    #  sequence of items between startstate and endstate
+    #
+    def toJulius_seq(self, items, dfa, startstate, endstate):
+        currentstate = startstate
+        for i in items[:-1]:
+            newstate = dfa.newstate()
+            self.toJulius_recur(i, dfa, currentstate, newstate)
+            currentstate = newstate
+        self.toJulius_recur(items[-1], dfa, currentstate, endstate)
+
+    #
+    #  plain text items of one-of sharing their common prefixes
+    #    common suffixes are shared by minimize() later
+    #
+    def toJulius_trie(self, items, dfa, startstate, endstate):
+        children = {}
+        finals = set()
+        for i in items:
+            words = i._items[0]._words
+            if len(words) == 0:
+                raise KeyError("no words in <item></item>")
+            currentstate = startstate
+            for w in words[:-1]:
+                try:
+                    currentstate = children[(currentstate, w)]
+                except KeyError:
+                    newstate = dfa.newstate()
+                    children[(currentstate, w)] = newstate
+                    dfa.append((currentstate, w, newstate))
+                    currentstate = newstate
+            if not (currentstate, words[-1]) in finals:
+                finals.add((currentstate, words[-1]))
+                dfa.append((currentstate, words[-1], endstate))
+
+    #
+    #  automaton of the rule from STARTSTATE to ENDSTATE
+    #    compiled once and spliced into each reference
+    #
+    def fragment(self, ruleid):
+        try:
+            return self._fragments[ruleid]
+        except KeyError:
+            pass
+        try:
+            rule = self._rules[ruleid]
+        except KeyError:
+            raise KeyError("unknown rule: #%s" % (ruleid,))
+        if rule._items is None:
+            self.load()
+            rule = self._rules[ruleid]
+        if ruleid in self._compiling:
+            raise KeyError("recursive reference to rule: #%s" % (ruleid,))
+        self._compiling.add(ruleid)
+        try:
+            frag = DFA()
+            self.toJulius_seq(rule._items, frag, frag.STARTSTATE, frag.ENDSTATE)
+        finally:
+            self._compiling.discard(ruleid)
+        self._fragments[ruleid] = frag
+        return frag
+
     #
     #
     #
     def toJulius(self, rootrule = None):
         if rootrule is None:
-            root = self._rules[self._rootrule]
-        else:
-            root = self._rules[rootrule]
+            rootrule = self._rootrule
+        return self.toJuliusAll([rootrule,])[0][1]
 
-        lex = None
-        if self._lex is not None:
-            lex = PLS().parse(self._lex)
-        lexdb = LexiconDB(self._config._lexicondb, __version__, self._prop, self._rebuild_lexicon)
+    #
+    #  compile rules (all rules if None) and returns [(rule, grammar), ...]
+    #  in the order of rules. rules are compiled by 'jobs' processes.
+    #
+    def toJuliusAll(self, rules=None, jobs=1):
+        if rules is None:
+            rules = list(self._rules.keys())
+        results = {}
+        key = None
+        if self._cache is not None and not self._rebuild_lexicon:
+            key = self.cachekey()
+        todo = []
+        for r in rules:
+            if key is not None:
+                results[r] = self._cache.get(key, r)
+                if results[r] is not None:
+                    self._compiletimes[r] = 0.0
+                    continue
+            todo.append(r)
+
+        if len(todo) > 0:
+            start = time.time()
+            lex = None
+            if self._lex is not None:
+                lex = PLS().parse(self._lex)
+            lexdb = openlexicon(__version__, self._prop, self._rebuild_lexicon, self._backend)
+            self.phasetime('lexicon', start)
+            if jobs > 1 and len(todo) > 1 and not isinstance(self._filename, StringIO):
+                maxvariants = lexdb._maxvariants
+                del lexdb
+                self.compile_parallel(todo, jobs, lex, results, maxvariants)
+            else:
+                for r in todo:
+                    start = time.time()
+                    results[r] = self.compile(r, lex, lexdb)
+                    self._compiletimes[r] = time.time() - start
+
+        if key is not None and len(todo) > 0:
+            for r in todo:
+                self._cache.put(key, r, results[r])
+            self._cache.prune()
+        return [(r, results[r]) for r in rules]
+
+    #
+    #  compile rules by process pool sharing parsed lexicon
+    #
+    def compile_parallel(self, rules, jobs, lex, results, maxvariants=MAX_VARIANTS):
+        from concurrent.futures import ProcessPoolExecutor
+        thirdparty = None
+        if self._prop and self._prop.getProperty("julius.3rdparty_dir"):
+            thirdparty = self._prop.getProperty("julius.3rdparty_dir")
+        with ProcessPoolExecutor(max_workers=min(jobs, len(rules)), initializer=_compile_init,
+                                 initargs=(self._filename, thirdparty, lex, self._backend, maxvariants)) as executor:
+            for (r, data, t, stats, phases, lexstats) in executor.map(_compile_rule, rules):
+                results[r] = data
+                self._compiletimes[r] = t
+                self._compilestats[r] = stats
+                for (k, v) in phases.items():
+                    self._phasetimes[k] = self._phasetimes.get(k, 0.0) + v
+                for (k, v) in lexstats.items():
+                    self._lexstats[k] += v
+
+    #
+    #  construct the automaton of the rule
+    #
+    def build(self, rootrule):
+        frag = self.fragment(rootrule)
 
         dfa = DFA()
         startstate = dfa.newstate()
         dfa.append((dfa.STARTSTATE, '<s>', startstate))
         dfa.append((dfa.ENDSTATE, '</s>', dfa.EOA))
-        currentstate = startstate
-        for i in root._items[:-1]:
-            newstate = dfa.newstate()
-            self.toJulius_recur(i, dfa, currentstate, newstate)
-            currentstate = newstate
-        self.toJulius_recur(root._items[-1], dfa, currentstate, dfa.ENDSTATE)
+        dfa.splice(frag, startstate, dfa.ENDSTATE)
+        return dfa
+
+    #
+    #  compile the rule into Julius grammar (DFA and dict)
+    #
+    def compile(self, rootrule, lex=None, lexdb=None):
+        start = time.time()
+        if lex is None and self._lex is not None:
+            lex = PLS().parse(self._lex)
+        if lexdb is None:
+            lexdb = openlexicon(__version__, self._prop, self._rebuild_lexicon, self._backend)
+        self.phasetime('lexicon', start)
+
+        start = time.time()
+        dfa = self.build(rootrule)
+        self.phasetime('build', start)
+        start = time.time()
         revdfa = dfa.reverse()
+        before = arcstats(revdfa)
+        revdfa = minimize(determinize(revdfa))
+        after = arcstats(revdfa)
+        self.phasetime('minimize', start)
+        if len(revdfa) == 0:
+            raise KeyError("no sentences accepted by rule: #%s" % (rootrule,))
 
+        start = time.time()
         dict = {}
         if self._lang in ('jp', 'ja'):
             dict['<s>'] = ('silB',)
@@ -356,24 +748,46 @@ class SRGS:
             conv = nulltransform()
 
         unknownlexicon = []
+        cachecounts = lexdb.cachecounts()
+        words = []
         for v in revdfa:
-            if v[1] != -1:
-                if (v[1] in dict) == False:
-                    p = None
-                    if lex is not None:
-                        p = lex._dict.get(v[1])
-                    if p is None:
-                        if self._lang in ('jp', 'ja'):
-                            p = lexdb.substringlookup(v[1])
-                            if len(p) == 0:
-                                p = lexdb.substringlookup(conv2.convert(v[1]))
-                        else:
-                            p = lexdb.lookup(v[1])
-                    if len(p) == 0:
-                        unknownlexicon.append(v[1])
-                    dict[v[1]] = p
+            if v[1] != -1 and (v[1] in dict) == False:
+                dict[v[1]] = None
+                words.append(v[1])
+
+        # words not in the PLS lexicons are looked up in the lexicon database at once
+        dbwords = []
+        for w in words:
+            p = None
+            if lex is not None:
+                p = lex._dict.get(w)
+            if p is None:
+                dbwords.append(w)
+            else:
+                self._lexstats['pls_hits'] += 1
+                dict[w] = p
+        found = lexdb.lookup_many(dbwords)
+        for w in dbwords:
+            p = found[w]
+            if len(p) == 0 and self._lang in ('jp', 'ja'):
+                p = lexdb.substringlookup(w)
+                if len(p) == 0:
+                    p = lexdb.substringlookup(conv2.convert(w))
+            if len(p) > 0:
+                self._lexstats['db_hits'] += 1
+            else:
+                unknownlexicon.append(w)
+                self._lexstats['misses'] += 1
+            dict[w] = p
+        self._lexstats['cache_hits'] += lexdb.cachecounts()[0] - cachecounts[0]
+        self._lexstats['cache_misses'] += lexdb.cachecounts()[1] - cachecounts[1]
+        self.phasetime('lexicon', start)
+        self._compilestats[rootrule] = { 'states': (before[0], after[0]), 'arcs': (before[1], after[1]),
+                                         'words': len(dict) - 2 }
         if len(unknownlexicon) > 0:
             raise KeyError("undefined lexicon: " + ",".join(unknownlexicon))
+
+        start = time.time()
         dict2id = {}
 
         #print("--", dict)
@@ -408,6 +822,7 @@ class SRGS:
         for p in phonedict:
             str += u"%i\t[%s]\t%s\n" % p
         str += u"DICEND\n"
+        self.phasetime('output', start)
 
         return str
 
@@ -420,29 +835,93 @@ class DFA:
     STARTSTATE = 0
     ENDSTATE = 1
     EOA = -1 # End Of Automaton
+    EPSILON = None # label of empty transition
     
     #
+    #  arcs are kept in array columns (_from, _label, _to). labels are ids
+    #  of words interned in _words (-1 for EPSILON).
     #
     def __init__(self):
-        self._dfa = list()
+        self._from = array('i')
+        self._label = array('i')
+        self._to = array('i')
+        self._words = []
+        self._wordid = {}
         self._totalstate = 2
 
+    def __len__(self):
+        return len(self._from)
+
     #
     #
     def newstate(self):
         self._totalstate += 1
         return self._totalstate - 1
+
+    #
+    #  id of the word label
+    #
+    def wordid(self, word):
+        if word is self.EPSILON:
+            return -1
+        try:
+            return self._wordid[word]
+        except KeyError:
+            self._wordid[word] = len(self._words)
+            self._words.append(word)
+            return len(self._words) - 1
+
+    def word(self, wid):
+        if wid < 0:
+            return self.EPSILON
+        return self._words[wid]
     
     #
     #
     def append(self, value):
-        self._dfa.append(value)
+        self._from.append(value[0])
+        self._label.append(self.wordid(value[1]))
+        self._to.append(value[2])
+
+    #
+    #  arcs as (from, word, to)
+    #
+    def arcs(self):
+        words = self._words
+        for (f, l, t) in zip(self._from, self._label, self._to):
+            yield (f, (words[l] if l >= 0 else self.EPSILON), t)
+
+    #
+    #  copy arcs of the fragment between 'startstate' and 'endstate'
+    #    STARTSTATE/ENDSTATE of the fragment are mapped to them and
+    #    the other states of the fragment are renumbered.
+    #
+    def splice(self, frag, startstate, endstate):
+        offset = self._totalstate - 2
+        self._totalstate += frag._totalstate - 2
+        labels = [self.wordid(w) for w in frag._words]
+        for (f, l, t) in zip(frag._from, frag._label, frag._to):
+            if f == frag.STARTSTATE:
+                f = startstate
+            elif f == frag.ENDSTATE:
+                f = endstate
+            else:
+                f += offset
+            if t == frag.STARTSTATE:
+                t = startstate
+            elif t == frag.ENDSTATE:
+                t = endstate
+            else:
+                t += offset
+            self._from.append(f)
+            self._label.append(labels[l] if l >= 0 else -1)
+            self._to.append(t)
     
     #
     #
     def reverse(self): # convert dfa into reverse order
         newdfa = list()
-        for v in self._dfa:
+        for v in self.arcs():
             fromstate = v[0]
             tostate = v[2]
             if tostate == self.EOA:
@@ -454,6 +933,251 @@ class DFA:
             newdfa.append((tostate, v[1], fromstate))
         return newdfa
 
+#
+#  worker process of SRGS.compile_parallel
+#    the grammar is parsed once per process and the lexicon database is
+#    opened read only (it is built by the parent if needed).
+#
+_worker = None
+
+def _compile_init(filename, thirdparty, lex, backend, maxvariants):
+    global _worker
+    srgs = SRGS(filename, backend=backend)
+    if thirdparty:
+        srgs._config.julius(thirdparty)
+    lexdb = openlexicon(__version__, backend=backend, maxvariants=maxvariants)
+    _worker = (srgs, lex, lexdb)
+
+def _compile_rule(rule):
+    (srgs, lex, lexdb) = _worker
+    srgs._phasetimes = {}
+    srgs._lexstats = dict([(k, 0) for k in srgs._lexstats.keys()])
+    start = time.time()
+    data = srgs.compile(rule, lex, lexdb)
+    return (rule, data, time.time() - start, srgs._compilestats.get(rule),
+            srgs._phasetimes, srgs._lexstats)
+
+#
+#  number of states and word arcs of the automaton in list form
+#    [(from, word, to), ..., (state, -1, -1) for accept states]
+#
+def arcstats(arcs):
+    states = set()
+    narcs = 0
+    for (f, w, t) in arcs:
+        states.add(f)
+        if w != -1:
+            states.add(t)
+            narcs += 1
+    return (len(states), narcs)
+
+#
+#  subset construction: returns deterministic automaton whose states are
+#  numbered in breadth first order from 'start'. empty transitions
+#  (DFA.EPSILON) are removed.
+#
+def determinize(arcs, start=DFA.STARTSTATE):
+    trans = {}
+    epsilon = {}
+    accept = set()
+    for (f, w, t) in arcs:
+        if w == -1:
+            accept.add(f)
+        elif w is DFA.EPSILON:
+            epsilon.setdefault(f, set()).add(t)
+        else:
+            trans.setdefault(f, {}).setdefault(w, set()).add(t)
+
+    def closure(states):
+        if len(epsilon) == 0:
+            return frozenset(states)
+        result = set(states)
+        stack = list(states)
+        while stack:
+            for t in epsilon.get(stack.pop(), ()):
+                if not t in result:
+                    result.add(t)
+                    stack.append(t)
+        return frozenset(result)
+
+    first = closure((start,))
+    ids = { first: 0 }
+    queue = [first]
+    result = []
+    n = 0
+    while n < len(queue):
+        subset = queue[n]
+        moves = {}
+        for s in subset:
+            for (w, ts) in trans.get(s, {}).items():
+                moves.setdefault(w, set()).update(ts)
+        for w in sorted(moves.keys()):
+            target = closure(moves[w])
+            try:
+                tid = ids[target]
+            except KeyError:
+                tid = ids[target] = len(queue)
+                queue.append(target)
+            result.append((n, w, tid))
+        if not accept.isdisjoint(subset):
+            result.append((n, -1, -1))
+        n += 1
+    return result
+
+#
+#  Hopcroft's partition refinement of deterministic automaton
+#    states which can not reach accept states are removed first, so that
+#    they do not split blocks. missing transitions go to an implicit dead
+#    state, so both initial blocks are put in the worklist.
+#
+def minimize(arcs, start=DFA.STARTSTATE):
+    """
+    >>> minimize([(0,'a',1),(0,'b',2),(1,'x',3),(1,-1,-1),(2,-1,-1)])
+    [(0, 'a', 1), (0, 'b', 1), (1, -1, -1)]
+    >>> minimize(minimize([(0,'a',1),(0,'b',2),(1,'x',3),(1,-1,-1),(2,-1,-1)]))
+    [(0, 'a', 1), (0, 'b', 1), (1, -1, -1)]
+    >>> minimize([(0,'a',1),(1,'b',0)])
+    []
+    """
+    nstates = 0
+    accept = set()
+    for (f, w, t) in arcs:
+        nstates = max(nstates, f + 1, t + 1)
+        if w == -1:
+            accept.add(f)
+
+    #  co-reachable states
+    inv = [[] for s in range(nstates)]
+    for (f, w, t) in arcs:
+        if w != -1:
+            inv[t].append((w, f))
+    alive = set(accept)
+    stack = list(accept)
+    while stack:
+        for (w, f) in inv[stack.pop()]:
+            if not f in alive:
+                alive.add(f)
+                stack.append(f)
+    if not start in alive:
+        return []
+    for t in range(nstates):
+        if t in alive:
+            inv[t] = [(w, f) for (w, f) in inv[t] if f in alive]
+        else:
+            inv[t] = []
+
+    blocks = []
+    blockof = [-1] * nstates
+    for b in (accept, alive - accept):
+        if len(b) > 0:
+            for s in b:
+                blockof[s] = len(blocks)
+            blocks.append(set(b))
+    worklist = list(range(len(blocks)))
+    inlist = set(worklist)
+
+    while worklist:
+        b = worklist.pop()
+        inlist.discard(b)
+        preds = {}
+        for t in blocks[b]:
+            for (w, f) in inv[t]:
+                preds.setdefault(w, set()).add(f)
+        for X in preds.values():
+            touched = {}
+            for s in X:
+                touched.setdefault(blockof[s], []).append(s)
+            for (bid, members) in touched.items():
+                if len(members) == len(blocks[bid]):
+                    continue
+                newid = len(blocks)
+                newblock = set(members)
+                blocks[bid] -= newblock
+                blocks.append(newblock)
+                for s in newblock:
+                    blockof[s] = newid
+                if bid in inlist or len(newblock) <= len(blocks[bid]):
+                    worklist.append(newid)
+                    inlist.add(newid)
+                else:
+                    worklist.append(bid)
+                    inlist.add(bid)
+
+    #  quotient automaton of co-reachable states
+    qtrans = {}
+    for (f, w, t) in arcs:
+        if w != -1 and f in alive and t in alive:
+            qtrans.setdefault(blockof[f], {})[w] = blockof[t]
+    qaccept = set([blockof[s] for s in accept])
+
+    #  renumber in breadth first order from start
+    ids = { blockof[start]: 0 }
+    queue = [blockof[start]]
+    result = []
+    n = 0
+    while n < len(queue):
+        b = queue[n]
+        moves = qtrans.get(b, {})
+        for w in sorted(moves.keys()):
+            t = moves[w]
+            try:
+                tid = ids[t]
+            except KeyError:
+                tid = ids[t] = len(queue)
+                queue.append(t)
+            result.append((n, w, tid))
+        if b in qaccept:
+            result.append((n, -1, -1))
+        n += 1
+    return result
+
+#
+#  minimized automaton of 'number digit{spec}' for the doctests of repeats
+#    returns (states, word arcs, numbers of digits accepted up to 'upto')
+#
+def _repeatcheck(spec, upto=6):
+    """
+    >>> _repeatcheck("2")
+    (6, 5, [2])
+    >>> _repeatcheck("0-1")
+    (5, 5, [0, 1])
+    >>> _repeatcheck("1-3")
+    (7, 8, [1, 2, 3])
+    >>> _repeatcheck("0-")
+    (4, 4, [0, 1, 2, 3, 4, 5, 6])
+    >>> _repeatcheck("1-")
+    (5, 5, [1, 2, 3, 4, 5, 6])
+    >>> _repeatcheck("3-")
+    (7, 7, [3, 4, 5, 6])
+    >>> _repeatcheck("0")
+    (4, 3, [0])
+    >>> _repeatcheck("100")[:2]
+    (104, 103)
+    >>> _repeatcheck("0-100")[:2]
+    (104, 203)
+    >>> _repeatcheck("3-1")
+    Traceback (most recent call last):
+    ...
+    KeyError: 'invalid repeat: 3-1'
+    """
+    grammar = (u'<grammar xmlns="http://www.w3.org/2001/06/grammar" xml:lang="en" version="1.0" root="main">'
+               u'<rule id="main"><item>number</item><item repeat="%s">digit</item></rule></grammar>' % (spec,))
+    srgs = SRGS(StringIO(grammar))
+    arcs = minimize(determinize(srgs.build('main').reverse()))
+    trans = dict([((f, w), t) for (f, w, t) in arcs if w != -1])
+    accept = set([f for (f, w, t) in arcs if w == -1])
+    counts = []
+    for n in range(upto + 1):
+        state = DFA.STARTSTATE
+        for w in ['</s>'] + ['digit'] * n + ['number', '<s>']:
+            state = trans.get((state, w))
+            if state is None:
+                break
+        if state in accept:
+            counts.append(n)
+    (states, narcs) = arcstats(arcs)
+    return (states, narcs, counts)
+
 #
 #
 def _test():
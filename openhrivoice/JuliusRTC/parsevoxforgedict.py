@@ -32,18 +32,11 @@ class VoxforgeDict:
     #
     #  parse file
     def parse(self, fname):
-        if fname[-3:] == '.gz':
-            f = gzip.open(fname, 'rb')
-        else:
-            f = open(fname, 'r')
-        for l in f:
-            t = re.split(r"\s+", l.strip(), 2)
-            st = ' '.join(t[2].split(' ')[:-1])
-            st = st.lower()
+        for (w, st) in voxforge_entries(fname):
             try:
-                self._dict[t[0]].append(st)
+                self._dict[w].append(st)
             except KeyError:
-                self._dict[t[0]] = [st,]
+                self._dict[w] = [st,]
 
    #
    #  lookup table
@@ -53,6 +46,22 @@ class VoxforgeDict:
         except KeyError:
             return []
 
+#
+#  Stream (word, pronunciation) entries of the dictionary file
+#
+def voxforge_entries(fname):
+    if fname[-3:] == '.gz':
+        f = gzip.open(fname, 'rt')
+    else:
+        f = open(fname, 'r')
+    with f:
+        for l in f:
+            t = re.split(r"\s+", l.strip(), 2)
+            if len(t) < 3:
+                continue
+            st = ' '.join(t[2].split(' ')[:-1])
+            yield (t[0], st.lower())
+
 if __name__ == '__main__':
   #  doc = VoxforgeDict('/usr/share/doc/julius-voxforge/dict.gz')
     doc = VoxforgeDict('D:\local\Julius\Julius_AcousticModels_16kHz-16bit_MFCC_O_D_(0_1_1-build726)\dict')
@@ -135,6 +135,28 @@ def genmanagerargs(opt):
         args.append('-d')
     return args
 
+#
+#  properties of a configuration file ("name: value" lines) for tools
+#  running without the manager
+#
+class ConfProperties(dict):
+    def __init__(self, fname=None):
+        dict.__init__(self)
+        if fname :
+            self.load(fname)
+
+    def load(self, fname):
+        with open(fname, 'r', encoding='utf-8') as f:
+            for l in f:
+                l = l.strip()
+                if not l or l.startswith('#') or l.find(':') <= 0:
+                    continue
+                (name, value) = l.split(':', 1)
+                self[name.strip()] = value.strip()
+
+    def getProperty(self, name):
+        return self.get(name, "")
+
 def getHriDir():
   if 'OPENHRI_ROOT' in os.environ and os.environ['OPENHRI_ROOT']:
     return os.environ['OPENHRI_ROOT']
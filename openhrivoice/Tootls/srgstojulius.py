@@ -16,6 +16,8 @@ http://www.opensource.org/licenses/eclipse-1.0.txt
 import sys
 import codecs
 import optparse
+import time
+import json
 from openhrivoice.parsesrgs import *
 from openhrivoice.__init__ import __version__
 import locale
@@ -31,8 +33,52 @@ Examples:
   ::
   
   $ srgstojulius sample.grxml > sample.julius
+
+- '''+ 'Show compile time of each phase and size of all rules.' +'''
+
+  ::
+
+  $ srgstojulius --stats --all-rules sample.grxml > sample.julius
+
+- '''+ 'Save the statistics with peak memory in JSON format.' +'''
+
+  ::
+
+  $ srgstojulius --profile --json stats.json sample.grxml > sample.julius
 '''
 
+#
+#  statistics of the compilation
+#
+def report(srgs, rules, elapsed, peak=None):
+    stats = { 'grammar': srgs._filename, 'elapsed': elapsed,
+              'phases': srgs._phasetimes, 'lexicon': srgs._lexstats, 'rules': {} }
+    for r in rules:
+        st = srgs._compilestats.get(r, {})
+        stats['rules'][r] = { 'time': srgs._compiletimes.get(r, 0.0),
+                              'states': st.get('states', (0, 0))[1], 'arcs': st.get('arcs', (0, 0))[1],
+                              'states_before_minimize': st.get('states', (0, 0))[0],
+                              'arcs_before_minimize': st.get('arcs', (0, 0))[0],
+                              'words': st.get('words', 0) }
+    if peak is not None:
+        stats['peak_memory'] = peak
+    return stats
+
+def printreport(stats, out):
+    print ("grammar: %s (%.1f msec)" % (stats['grammar'], stats['elapsed'] * 1000), file=out)
+    print ("phases:", file=out)
+    for (k, v) in stats['phases'].items():
+        print ("  %-10s %10.1f msec" % (k, v * 1000), file=out)
+    print ("lexicon: pls hits %(pls_hits)d, db hits %(db_hits)d, misses %(misses)d, "
+           "db cache hits %(cache_hits)d, db cache misses %(cache_misses)d" % stats['lexicon'], file=out)
+    print ("rules:", file=out)
+    for (r, st) in stats['rules'].items():
+        print ("  %-16s states %6d (%d) arcs %6d (%d) words %6d %10.1f msec" %
+               (r, st['states'], st['states_before_minimize'], st['arcs'], st['arcs_before_minimize'],
+                st['words'], st['time'] * 1000), file=out)
+    if 'peak_memory' in stats:
+        print ("peak memory: %d KB" % (stats['peak_memory'] / 1024,), file=out)
+
 def main():
     #encoding = locale.getpreferredencoding()
     #sys.stdout = codecs.getwriter(encoding)(sys.stdout, errors = "replace")
@@ -46,6 +92,18 @@ def main():
     parser.add_option('-r', '--target-rule', dest='targetrule', action="store",
                       type="string",
                       help='specify target rule id')
+    parser.add_option('-s', '--stats', dest='stats', action='store_true',
+                      default=False,
+                      help='show compile time of each phase and size of rules on stderr')
+    parser.add_option('-p', '--profile', dest='profile', action='store_true',
+                      default=False,
+                      help='--stats with peak memory and profile of functions')
+    parser.add_option('-a', '--all-rules', dest='allrules', action='store_true',
+                      default=False,
+                      help='compile all rules for the statistics')
+    parser.add_option('-j', '--json', dest='json', action="store",
+                      type="string",
+                      help='write the statistics in JSON format to the file (- for stdout)')
     try:
         opts, args = parser.parse_args()
     except optparse.OptionError as e:
@@ -56,9 +114,42 @@ def main():
         parser.error("wrong number of arguments")
         sys.exit(1)
 
+    if not (opts.stats or opts.profile or opts.json):
+        srgs = SRGS(args[0])
+        print (srgs.toJulius(opts.targetrule))
+        return
+
+    if opts.profile:
+        import tracemalloc, cProfile, pstats
+        tracemalloc.start()
+        prof = cProfile.Profile()
+        prof.enable()
+    start = time.time()
     srgs = SRGS(args[0])
+    target = opts.targetrule or srgs._rootrule
+    rules = [target,]
+    if opts.allrules:
+        rules = list(srgs._rules.keys())
+    results = dict(srgs.toJuliusAll(rules))
+    elapsed = time.time() - start
+    peak = None
+    if opts.profile:
+        prof.disable()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
 
-    print (srgs.toJulius(opts.targetrule))
+    stats = report(srgs, rules, elapsed, peak)
+    if opts.json != '-':
+        print (results[target])
+    if opts.stats or opts.profile:
+        printreport(stats, sys.stderr)
+    if opts.profile:
+        pstats.Stats(prof, stream=sys.stderr).sort_stats('cumulative').print_stats(20)
+    if opts.json == '-':
+        print (json.dumps(stats, indent=2, ensure_ascii=False))
+    elif opts.json:
+        with open(opts.json, 'w', encoding='utf-8') as f:
+            json.dump(stats, f, indent=2, ensure_ascii=False)
 
 if __name__ == '__main__':
     main()